@@ -6,6 +6,7 @@ import math
 
 
 class AbilityModifier(Modifier):
+    __slots__ = ()
     stackable = True
     
     def __init__(self, source):
@@ -1,22 +1,41 @@
-from itertools import groupby
+from collections import deque
 
 
 def calculate_modifier_sum(modifiers):
     "Default algorithm to calculate the sum of all modifiers values."
-    def add(klass, group): 
+    buckets = {}
+    for m in modifiers:
+        buckets.setdefault(type(m), []).append(m)
+    return sum_buckets(buckets)
+
+
+def sum_buckets(buckets):
+    """
+    Sums up modifiers grouped by their type. Of a type that does not stack 
+    only the highest modifier counts.
+    """
+    total = 0
+    for klass, bucket in buckets.items():
         if klass.stackable:
-            return sum(group) 
-        return max(group).value
-    return sum(add(k, g) for k, g in groupby(modifiers, type))
+            total += sum(m.value for m in bucket)
+        else:
+            total += max(m.value for m in bucket)
+    return total
 
 
 class Modifier(object):
+    """
+    A bonus or malus coming from a source. Modifiers are equal if they come
+    from the same source, modifiers without a source are all distinct.
+    Modifiers are tiny and numerous, subclasses should declare __slots__.
+    """
+    __slots__ = ("_value", "_source")
     stackable = False    
     
     def __init__(self, value, source=None):
         assert isinstance(value, int)
         self._value = value
-        self._source = source or object()
+        self._source = source
     
     @property
     def source(self):
@@ -39,19 +58,39 @@ class Modifier(object):
         return self.value
     
     def __hash__(self):
+        if self._source is None:
+            return object.__hash__(self)
         return self._source.__hash__()
     
     def __eq__(self, other):
+        if self._source is None:
+            return self is other
         return other._source == self._source
     
     def __repr__(self):
         return "<%s: %+i>" % (self.__class__.__name__, self.value)
     
+    
     def stacks(self):
         return self.__class__.stackable
 
 
 class Modifiable(object):
+    """
+    Something with an initial value that can be changed by modifiers. The
+    calculated value is memoized and only recalculated after the object
+    itself or one of the sources of its modifiers has changed. Modifiers
+    are kept in buckets by type, which are made and registered with the
+    sources of the modifiers when the value is first calculated, so nothing
+    is tracked for values never read. After that modifiers are sorted into
+    and out of their bucket as they are added and removed.
+    """
+    cached = True
+    _cache = None
+    _dirty = True
+    _version = 0
+    _buckets = None
+    _dependents = frozenset()
     
     def __init__(self, initial=0):
         self._initial = initial
@@ -59,24 +98,113 @@ class Modifiable(object):
         
     def is_modifiable(self):
         return True
+    
+    @property
+    def initial(self):
+        "The value before any modifiers are applied."
+        return self._initial
+    
+    @property
+    def version(self):
+        "Counts the changes that may have affected the value."
+        return self._version
         
     def update(self, *modifiers):
+        present = self._modifiers
+        if self._buckets is None:
+            # the value has never been calculated, the buckets are made
+            # when it is, so there is nothing to keep up to date
+            present.update(modifiers)
+            return
+        changed = False
         for m in modifiers:
-            self._modifiers.add(m)
+            if m not in present:
+                present.add(m)
+                self._sort(m)
+                changed = True
+        if changed:
+            self.invalidate()
         
     def remove(self, modifier):
         self._modifiers.remove(modifier)
+        buckets = self._buckets
+        if buckets is not None:
+            klass = type(modifier)
+            if modifier not in buckets.get(klass, ()):
+                # an equal modifier of another type, from the same source
+                klass = next(k for k, b in buckets.items() if modifier in b)
+            bucket = buckets[klass]
+            bucket.remove(modifier)
+            if not bucket:
+                del buckets[klass]
+        if isinstance(modifier.source, Modifiable):
+            dependents = modifier.source._dependents
+            if self in dependents:
+                dependents.discard(self)
+        self.invalidate()
+        
+    def invalidate(self):
+        "Marks the value of this object and of everything depending on it as stale."
+        if not self._dependents:
+            self._dirty = True
+            self._version += 1
+            return
+        seen = set()
+        stack = [self]
+        while stack:
+            current = stack.pop()
+            if current in seen:
+                continue
+            seen.add(current)
+            current._dirty = True
+            current._version += 1
+            stack.extend(current._dependents)
+            
+    def calculate(self):
+        "Computes the value from scratch, override this instead of value."
+        return self._initial + sum_buckets(self._buckets)
         
     @property
     def value(self):
-        return self._initial + calculate_modifier_sum(self._modifiers)
+        if self._dirty or not self.cached:
+            if self._buckets is None:
+                self._group()
+            self._cache = self.calculate()
+            self._dirty = False
+        return self._cache
+    
+    def _group(self):
+        """
+        Sorts the modifiers into buckets by type on the first calculation,
+        later modifiers are sorted in as they are added.
+        """
+        self._buckets = {}
+        for m in self._modifiers:
+            self._sort(m)
+    
+    def _sort(self, modifier):
+        "Puts the modifier into its bucket, registering with its source."
+        klass = type(modifier)
+        bucket = self._buckets.get(klass)
+        if bucket is None:
+            self._buckets[klass] = set([modifier])
+        else:
+            bucket.add(modifier)
+        source = modifier._source
+        if isinstance(source, Modifiable):
+            if source._dependents:
+                source._dependents.add(self)
+            else:
+                source._dependents = set([self])
     
     @value.setter
     def value(self, new_value):
         self._initial = new_value
+        self.invalidate()
     
     def __str__(self):
         return str(self.value)    
+    
         
     def __repr__(self):
         return "<%s: %s>" % (self.__class__.__name__, self.value)
@@ -88,27 +216,93 @@ class Registry(object):
     
     def __init__(self):
         self._components = {}
+        self._deferred = {}
+        self._observers = []
         
     @property
     def components(self):
         return self._components.values()
+    
+    def observe(self, observer):
+        """
+        The observer's added() and removed() get called on every change,
+        added_all() after extend() and materialized() after a deferred 
+        component has been created.
+        """
+        self._observers.append(observer)
+        
+    def extend(self, components):
+        """
+        Sets many components at once, observers get a single added_all() 
+        call with all of them (subcomponents included) instead of added().
+        """
+        registered = self._components
+        deferred = self._deferred
+        added = []
+        stack = list(components)
+        stack.reverse()
+        while stack:
+            component = stack.pop()
+            id = component.id
+            if id in registered:
+                self._notify("removed", registered[id])
+            if deferred:
+                deferred.pop(id, None)
+            registered[id] = component
+            added.append(component)
+            if component.subcomponents:
+                stack.extend(component.subcomponents)
+        for observer in self._observers:
+            observer.added_all(added)
         
     def set(self, component):
+        previous = self._components.get(component.id)
+        if previous is not None:
+            self._notify("removed", previous)
+        self._deferred.pop(component.id, None)
         self._components[component.id] = component
+        self._notify("added", component)
         for child in component.subcomponents:
             self.set(child)
         return component
+    
+    def defer(self, id, placeholder):
+        """
+        Registers a placeholder for a component that is only created once 
+        it gets changed. Until then get() returns placeholder.view(registry),
+        placeholder.create() has to build the real component.
+        """
+        self._deferred[id] = placeholder
+        
+    def materialize(self, id):
+        "Replaces a deferred placeholder with the real component"
+        component = self.set(self._deferred[id].create())
+        self._notify("materialized", component)
+        return component
             
     def get(self, id):
-        return self._components[id]
+        try:
+            return self._components[id]
+        except KeyError:
+            return self._deferred[id].view(self)
     
     def has(self, id):
-        return id in self._components
+        return id in self._components or id in self._deferred
+    
+    def is_deferred(self, id):
+        return id in self._deferred
     
     def remove(self, id):
+        if self._deferred.pop(id, None) is not None:
+            return
         for child in self.get(id).subcomponents:
-            self.remove(child)
-        del self._components[id]
+            if self.has(child.id):
+                self.remove(child.id)
+        self._notify("removed", self._components.pop(id))
+        
+    def _notify(self, event, component):
+        for observer in self._observers:
+            getattr(observer, event)(component)
 
 
 class Component(Modifiable):
@@ -151,11 +345,17 @@ class Actor(object):
         
 class Link(object):
     "Links a particular modifier to another component"
+    __slots__ = ("source", "target", "modifier")
+    
     def __init__(self, source, target, modifier):
         self.source = source
         self.target = target
         self.modifier = modifier
         
+    def modifiers(self, registry):
+        return [self.modifier]
+    
+        
     def connect(self, registry):
         registry.get(self.target).update(self.modifier)
         
@@ -165,15 +365,21 @@ class Link(object):
         )
      
         
-class ReverseLink(object):
+class ReverseLink(Link):
     "Depend on another component's default modifier"    
+    __slots__ = ()
+    
     def __init__(self, source, target):
         self.source = source
         self.target = target
         
+    def modifiers(self, registry):
+        return [registry.get(self.source).bonus]
+    
     def connect(self, registry):
-        source_obj = registry.get(self.source)
-        registry.get(self.target).update(source_obj.bonus)
+        bonus = registry.get(self.source).bonus
+        registry.get(self.target).update(bonus)
+    
         
     def __repr__(self):
         return "<ReverseLink: '%s' is modified by '%s'>" % (
@@ -181,15 +387,21 @@ class ReverseLink(object):
         )
         
         
-class UseLink(object):
+class UseLink(Link):
     "Use all modifiers of a source to the target"    
+    __slots__ = ()
+    
     def __init__(self, source, target):
         self.source = source
         self.target = target
         
+    def modifiers(self, registry):
+        return list(registry.get(self.source)._modifiers)
+    
     def connect(self, registry):
-        source_obj = registry.get(self.source)
-        registry.get(self.target).update(*source_obj._modifiers)
+        modifiers = registry.get(self.source)._modifiers
+        registry.get(self.target).update(*modifiers)
+    
         
     def __repr__(self):
         return "<UseLink: '%s' uses all modifiers from '%s'>" % (
@@ -198,30 +410,233 @@ class UseLink(object):
         
      
 class LinkProcessor(object):
+    """
+    Keeps the links of all registered components in a dependency graph of
+    component ids. After a change only the links leading into the part of
+    the graph downstream of the changed components are connected again, 
+    ordered so that e.g. 'touch' copies the modifiers of 'armor-class' only
+    after all of them have been added. Connecting everything for the first 
+    time doesn't need the graph, it is only built on the next change.
+    """
     
     def __init__(self, registry):
         self.registry = registry
         self.unapplied = set()
+        self.pending = set()
+        self._incoming = {}
+        self._outgoing = {}
+        self._copies = {}
+        self._unindexed = []
+        self._linked = False
+        self._processing = False
+        self._held = 0
+        self.added_all(registry.components)
+        registry.observe(self)
+        
+    def added(self, component):
+        "Registry callback, the links of a new component need to be connected"
+        self._unindexed.append(component)
+        self.pending.add(component.id)
+        
+    def added_all(self, components):
+        "Registry callback, like added() for many components"
+        components = list(components)
+        self._unindexed.extend(components)
+        self.pending.update([c.id for c in components])
+        
+    def removed(self, component):
+        "Registry callback, takes the links of a component out of the graph"
+        self.index()
+        for link in component.links:
+            self._incoming[link.target].discard(link)
+            self._outgoing[link.source].discard(link)
+            self._copies.get(link.source, set()).discard(link)
+            self.unapplied.discard(link)
+        self.pending.discard(component.id)
+        
+    def materialized(self, component):
+        "Registry callback, a deferred component needs to be linked right away"
+        self.process()
+        
+    def index(self):
+        "Puts the links of the components added since last time into the graph"
+        incoming = self._incoming
+        outgoing = self._outgoing
+        for component in self._unindexed:
+            for link in component.links:
+                target = incoming.get(link.target)
+                if target is None:
+                    target = incoming[link.target] = set()
+                target.add(link)
+                source = outgoing.get(link.source)
+                if source is None:
+                    source = outgoing[link.source] = set()
+                source.add(link)
+                if isinstance(link, UseLink):
+                    self._copies.setdefault(link.source, set()).add(link)
+        self._unindexed = []
     
     def apply(self, modifiable):
+        "Connects the links of a component that is not part of the registry"
         for link in modifiable.links:
-            try:
-                link.connect(self.registry)
-            except KeyError:
-                self.unapplied.add(link)
+            self._connect(link)
+        self.process(*[link.target for link in modifiable.links])
+        
+    def process(self, *ids):
+        """
+        Connects all links leading into the given components, into newly 
+        added components and into everything that depends on them.
+        """
+        self.pending.update(ids)
+        if self._processing or self._held:
+            return
+        self._processing = True
+        try:
+            if not self._linked:
+                self._link_all()
+            while self.pending:
+                changed, self.pending = self.pending, set()
+                for target in self._ordered(self.downstream(changed)):
+                    links = self._incoming.get(target)
+                    if links:
+                        self._connect_all(target, list(links))
+        finally:
+            self._processing = False
         
     def process_all(self):
-        for c in self.registry.components:
-            self.apply(c)
+        if not self._linked:
+            self.process()
+        else:
+            self.process(*[c.id for c in self.registry.components])
+        
+    def _link_all(self):
+        """
+        Connects the links of all components the first time. Only the links
+        copying modifiers (UseLink) need to be ordered, the others are 
+        connected as they come.
+        """
+        self.pending = set()
+        self._linked = True
+        registry = self.registry
+        copies = {}
+        into = {}
+        for component in list(registry.components):
+            for link in component.links:
+                if isinstance(link, UseLink):
+                    copies.setdefault(link.source, []).append(link)
+                    into.setdefault(link.target, []).append(link)
+                    continue
+                try:
+                    link.connect(registry)
+                except KeyError:
+                    self.unapplied.add(link)
+        ids = list(copies)
+        ids.extend(id for id in into if id not in copies)
+        for target in self._ordered(ids, copies):
+            for link in into.get(target, ()):
+                self._connect(link)
+        
+    def hold(self):
+        "Collects all changes until release() instead of processing them"
+        self._held += 1
+        
+    def release(self):
+        self._held -= 1
+        if not self._held:
+            self.process()
+        
+    def downstream(self, ids):
+        "All ids reachable from the given ids, including themselves"
+        self.index()
+        found = list(ids)
+        seen = set(found)
+        for id in found:
+            for link in self._outgoing.get(id, ()):
+                if link.target not in seen:
+                    seen.add(link.target)
+                    found.append(link.target)
+        return found
    
     def remove(self, modifiable):
+        self.index()
         for component in modifiable.subcomponents:
             self.remove(component)
-        self._run(modifiable, lambda c, m: c.remove(m))
-            
-    def _run(self, modifiable, callback):
         for link in modifiable.links:
-            callback(self.registry.get(link.target), link.modifier)
+            try:
+                self._withdraw(link.target, link.modifiers(self.registry))
+            except KeyError:
+                pass
+            
+    def _connect(self, link):
+        try:
+            link.connect(self.registry)
+            self.unapplied.discard(link)
+        except KeyError:
+            self.unapplied.add(link)
+            
+    def _connect_all(self, target, links):
+        "Connects links into the same target with a single update"
+        registry = self.registry
+        unapplied = self.unapplied
+        if not registry.has(target):
+            unapplied.update(links)
+            return
+        modifiers = []
+        for link in links:
+            try:
+                modifiers.extend(link.modifiers(registry))
+            except KeyError:
+                unapplied.add(link)
+            else:
+                if unapplied:
+                    unapplied.discard(link)
+        if modifiers:
+            registry.get(target).update(*modifiers)
+            
+    def _withdraw(self, id, modifiers):
+        "Removes modifiers from a component and from all components using them"
+        if self.registry.is_deferred(id):
+            return
+        target = self.registry.get(id)
+        for m in modifiers:
+            if m in target._modifiers:
+                target.remove(m)
+        for link in self._copies.get(id, ()):
+            self._withdraw(link.target, modifiers)
+                
+    def _ordered(self, ids, copies=None):
+        """
+        Sorts ids so that a component comes after those it copies modifiers
+        from (UseLink), members of a cycle are taken as they come. Other 
+        links add the same modifier whenever they are connected, so their
+        order doesn't matter. copies maps ids to the UseLinks from them.
+        """
+        if copies is None:
+            copies = self._copies
+        indegree = dict.fromkeys(ids, 0)
+        for id in ids:
+            for link in copies.get(id, ()):
+                if link.target in indegree:
+                    indegree[link.target] += 1
+        ready = deque(id for id in ids if not indegree[id])
+        if len(ready) == len(indegree):
+            return ready
+        remaining = set(ids)
+        order = []
+        while remaining:
+            if not ready:
+                ready.append(next(id for id in ids if id in remaining))
+            id = ready.popleft()
+            if id not in remaining:
+                continue
+            remaining.discard(id)
+            order.append(id)
+            for link in copies.get(id, ()):
+                if link.target in remaining:
+                    indegree[link.target] -= 1
+                    if indegree[link.target] == 0:
+                        ready.append(link.target)
+        return order
             
 
 class LinkBuilder(object):
@@ -250,37 +665,219 @@ class LinkBuilder(object):
         return self._component.links
             
             
+class Prototype(object):
+    """
+    Copies an object graph of components, modifiers and links many times.
+    The graph is walked once to record a plan, which is compiled into a
+    function that only allocates the objects and fills in references to
+    the new instances.
+    Immutable values and links that only refer to ids are shared between
+    all copies.
+    """
+    _atomic = frozenset([
+        type(None), bool, int, float, str, type, tuple, frozenset, object
+    ])
+    
+    def __init__(self, root):
+        self._index = {}
+        self._classes = []
+        self._slotted = []
+        self._static = []
+        self._references = []
+        self._sets = []
+        self._containers = []
+        self._factory = None
+        self._root = self._encode(root)
+        
+    def create(self):
+        if self._factory is None:
+            self._factory = self._compile()
+        return self._factory()
+    
+    def _compile(self):
+        """
+        Turns the plan into a function making one copy, with a local for
+        every object and a statement for every attribute, so nothing of the
+        plan has to be looked at again when copying.
+        """
+        constants = {"assign": object.__setattr__}
+        def constant(value):
+            if type(value) in (int, str, bool, type(None)):
+                return repr(value)
+            name = "c%d" % len(constants)
+            constants[name] = value
+            return name
+        lines = ["def create():"]
+        for i, cls in enumerate(self._classes):
+            lines.append("    o%d = %s.__new__(%s)" % (i, constant(cls), constant(cls)))
+        # plain attributes first, so that modifiers can be hashed by source
+        for i, cls in enumerate(self._classes):
+            values = [(n, constant(v)) for n, v in self._static[i].items()]
+            values += [(n, "o%d" % index) for n, index in self._references[i]]
+            self._assign(lines, i, cls, values)
+        for i, cls in enumerate(self._classes):
+            values = [(n, self._expression("objects", (shared, indices), constant))
+                      for n, shared, indices in self._sets[i]]
+            values += [(n, self._expression(kind, items, constant))
+                       for n, kind, items in self._containers[i]]
+            self._assign(lines, i, cls, values)
+        lines.append("    return %s" % self._expression(*self._root + (constant,)))
+        namespace = dict(constants)
+        exec(compile("\n".join(lines), "<prototype>", "exec"), namespace)
+        return namespace["create"]
+    
+    def _assign(self, lines, index, cls, values):
+        if not values:
+            return
+        if not self._slotted[index]:
+            lines.append("    o%d.__dict__.update({%s})" % (index, ", ".join(
+                "%r: %s" % (name, value) for name, value in values)))
+        elif cls.__setattr__ is object.__setattr__:
+            lines.extend("    o%d.%s = %s" % (index, name, value)
+                         for name, value in values)
+        else:
+            lines.extend("    assign(o%d, %r, %s)" % (index, name, value)
+                         for name, value in values)
+    
+    def _expression(self, kind, items, constant):
+        "Source of an expression rebuilding an encoded value"
+        if kind == "shared":
+            return constant(items)
+        if kind == "object":
+            return "o%d" % items
+        if kind == "objects":
+            shared, indices = items
+            members = ["*" + constant(tuple(shared))] if shared else []
+            members += ["o%d" % i for i in indices]
+            return "{%s}" % ", ".join(members) if members else "set()"
+        if kind == "flat-dict":
+            shared, references, sets = items
+            entries = ["**" + constant(dict(shared))] if shared else []
+            entries += ["%s: o%d" % (constant(k), i) for k, i in references]
+            entries += ["%s: %s" % (constant(k), self._expression(
+                            "objects", (members, indices), constant))
+                        for k, members, indices in sets]
+            return "{%s}" % ", ".join(entries)
+        if kind == "flat-list":
+            return "[%s]" % ", ".join(
+                "o%d" % v if reference else constant(v) for reference, v in items)
+        members = [self._expression(k, i, constant) for k, i in
+                   (items if kind != "dict" else [v for _, v in items])]
+        if kind == "set":
+            return "{%s}" % ", ".join(members) if members else "set()"
+        if kind == "list":
+            return "[%s]" % ", ".join(members)
+        return "{%s}" % ", ".join("%s: %s" % (constant(key), member) 
+                                  for (key, _), member in zip(items, members))
+        
+    def _is_shared(self, value):
+        cls = type(value)
+        if cls in self._atomic or cls is ReverseLink or cls is UseLink:
+            return True
+        return isinstance(value, tuple)
+    
+    def _encode(self, value):
+        if self._is_shared(value):
+            return ("shared", value)
+        cls = type(value)
+        if cls is set:
+            return self._encode_set(value)
+        if cls is list:
+            return self._encode_list(value)
+        if cls is dict:
+            return self._encode_dict(value)
+        if id(value) not in self._index:
+            self._add(value)
+        return ("object", self._index[id(value)])
+    
+    def _encode_set(self, items):
+        encoded = [self._encode(v) for v in items]
+        if any(kind not in ("shared", "object") for kind, _ in encoded):
+            return ("set", encoded)
+        shared = [v for kind, v in encoded if kind == "shared"]
+        indices = [v for kind, v in encoded if kind == "object"]
+        return ("objects", (shared, indices))
+        
+    def _encode_list(self, items):
+        encoded = [self._encode(v) for v in items]
+        if any(kind not in ("shared", "object") for kind, _ in encoded):
+            return ("list", encoded)
+        return ("flat-list", [(kind == "object", v) for kind, v in encoded])
+    
+    def _encode_dict(self, items):
+        # shared values go first, then references and sets of objects
+        encoded = [(k, self._encode(v)) for k, v in items.items()]
+        if any(kind not in ("shared", "object", "objects") for _, (kind, _) in encoded):
+            return ("dict", encoded)
+        shared = [(k, v) for k, (kind, v) in encoded if kind == "shared"]
+        references = [(k, v) for k, (kind, v) in encoded if kind == "object"]
+        sets = [(k,) + v for k, (kind, v) in encoded if kind == "objects"]
+        return ("flat-dict", (shared, references, sets))
+        
+    def _slots(self, cls):
+        return [name for c in cls.__mro__ for name in c.__dict__.get("__slots__", ())]
+        
+    def _add(self, obj):
+        self._index[id(obj)] = len(self._classes)
+        static, references, sets, containers = {}, [], [], []
+        slots = self._slots(type(obj))
+        self._classes.append(type(obj))
+        self._slotted.append(bool(slots))
+        self._static.append(static)
+        self._references.append(references)
+        self._sets.append(sets)
+        self._containers.append(containers)
+        state = dict(getattr(obj, "__dict__", {}))
+        state.update((n, getattr(obj, n)) for n in slots if hasattr(obj, n))
+        for name, value in state.items():
+            kind, items = self._encode(value)
+            if kind == "shared":
+                static[name] = items
+            elif kind == "object":
+                references.append((name, items))
+            elif kind == "objects":
+                sets.append((name,) + items)
+            else:
+                containers.append((name, kind, items))
+            
+            
 #--- concrete implementations of _modifiers -----------------------------------------
     
 class EnhancementModifier(Modifier): 
-    pass
+    __slots__ = ()
         
 
 class UntypedModifier(Modifier): 
+    __slots__ = ()
     stackable = True
 
 
 class SizeModifier(Modifier): 
-    pass      
+    __slots__ = ()
 
 
 class ArmorModifier(Modifier):
+    __slots__ = ()
     
     def __init__(self, source):
         Modifier.__init__(self, source.value, source)
 
 
 class ShieldModifier(Modifier):
+    __slots__ = ()
     
     def __init__(self, source):
         Modifier.__init__(self, source.value, source)
         
         
 class ValueModifier(Modifier):
+    __slots__ = ()
     stackable = True    
     
     def __init__(self, source):
-        Modifier.__init__(self, source.value, source)
+        # the value is always read from the source, reading it here would
+        # calculate it before the source has all its modifiers
+        Modifier.__init__(self, source.initial, source)
         
     @property
     def value(self):
@@ -288,4 +885,4 @@ class ValueModifier(Modifier):
 
 
 class NaturalArmorModifier(ValueModifier):
-    pass
\ No newline at end of file
+    __slots__ = ()
@@ -0,0 +1,148 @@
+"""
+Building large numbers of characters from one specification, spread over
+several processes. The characters are built in chunks, every chunk with
+its own random stream spawned from a single seed, so a run is reproducible
+regardless of the number of processes.
+"""
+import os
+
+from collections import deque
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+
+from statblock.character import PrototypeBuilder
+from statblock.character import Size
+from statblock.dice import RandomStream
+from statblock.dice import parse_dice
+from statblock.snapshot import dump
+
+try:
+    from statblock.table import CharacterTable
+except ImportError:
+    CharacterTable = None
+
+
+TABLE = "table"
+SNAPSHOT = "snapshot"
+
+
+class BuildSpec(namedtuple("BuildSpec", [
+        "abilities", "size", "skills", "feats", "equipment"])):
+    """
+    Describes the characters of a batch. abilities maps ability ids to a
+    fixed score, a dice expression like "4d6 drop lowest" rolled for each
+    character or a sequence of scores to pick from. skills maps skill ids
+    to ranks, feats and equipment are classes (or other picklable
+    callables) creating the components and items to add and activate.
+    """
+
+    def __new__(cls, abilities=None, size=None, skills=None, feats=(), equipment=()):
+        if isinstance(size, str):
+            size = Size.named(size)
+        return super(BuildSpec, cls).__new__(
+            cls, dict(abilities or {}), size, dict(skills or {}),
+            tuple(feats), tuple(equipment)
+        )
+
+
+_builder = None
+
+
+def _prototype_builder():
+    # one template per process, copying it is cheaper than building
+    global _builder
+    if _builder is None:
+        _builder = PrototypeBuilder()
+    return _builder
+
+
+def _roll_abilities(abilities, count, stream):
+    rolled = {}
+    for id, spec in abilities.items():
+        if isinstance(spec, int):
+            rolled[id] = [spec] * count
+        elif isinstance(spec, str):
+            rolled[id] = list(parse_dice(spec).roll_many(count, stream))
+        else:
+            rolled[id] = stream.choices(list(spec), count)
+    return rolled
+
+
+def build_characters(spec, count, rng=None):
+    "Builds count characters following the spec in this process."
+    stream = rng if isinstance(rng, RandomStream) else RandomStream(rng)
+    builder = _prototype_builder()
+    abilities = _roll_abilities(spec.abilities, count, stream)
+    characters = []
+    for row in range(count):
+        character = builder.build()
+        with character.batch():
+            for id, scores in abilities.items():
+                character.configure(id, int(scores[row]))
+            if spec.size is not None:
+                character.configure("size", spec.size)
+            for id, ranks in spec.skills.items():
+                character.configure(id, ranks)
+            for feat in spec.feats:
+                character.add_component(feat())
+            for factory in spec.equipment:
+                item = factory()
+                character.add_equipment(item)
+                character.activate_equipment(item.id)
+        characters.append(character)
+    return characters
+
+
+def _build_chunk(spec, count, stream, output):
+    characters = build_characters(spec, count, stream)
+    if output == SNAPSHOT:
+        return [dump(character) for character in characters]
+    return CharacterTable.from_characters(characters)
+
+
+def iter_batches(spec, count, output=TABLE, seed=None, chunk_size=1000,
+                 workers=None, max_pending=None):
+    """
+    Builds count characters in chunks of chunk_size across worker
+    processes and yields the chunks in order, either as CharacterTable or
+    as list of snapshots (see statblock.snapshot). At most max_pending
+    chunks (by default two per worker) are queued or waiting to be
+    consumed at a time, so a slow consumer holds back the workers instead
+    of piling up results. With workers=0 everything is built in the
+    current process.
+    """
+    if output not in (TABLE, SNAPSHOT):
+        raise ValueError("Unknown output %r" % output)
+    if output == TABLE and CharacterTable is None:
+        raise ValueError("Table output needs NumPy")
+    root = RandomStream(seed)
+    sizes = [min(chunk_size, count - start) for start in range(0, count, chunk_size)]
+
+    if workers == 0:
+        for size in sizes:
+            yield _build_chunk(spec, size, root.spawn(1)[0], output)
+        return
+
+    workers = workers or os.cpu_count() or 1
+    max_pending = max_pending or 2 * workers
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        pending = deque()
+        for size in sizes:
+            if len(pending) >= max_pending:
+                yield pending.popleft().result()
+            pending.append(executor.submit(
+                _build_chunk, spec, size, root.spawn(1)[0], output
+            ))
+        while pending:
+            yield pending.popleft().result()
+
+
+def generate(spec, count, output=TABLE, **options):
+    """
+    Builds count characters, returning a single CharacterTable or a list
+    of snapshots. Takes the options of iter_batches().
+    """
+    chunks = iter_batches(spec, count, output, **options)
+    if output == SNAPSHOT:
+        return [snapshot for chunk in chunks for snapshot in chunk]
+    return CharacterTable.concatenate(chunks)
@@ -1,3 +1,6 @@
+from collections import namedtuple
+from contextlib import contextmanager
+
 from statblock.ability import Charisma
 from statblock.ability import Constitution
 from statblock.ability import Dexterity
@@ -12,21 +15,29 @@ from statblock.base import ArmorModifier
 from statblock.base import Component
 from statblock.base import LinkBuilder
 from statblock.base import Modifier
+from statblock.base import Prototype
 from statblock.base import NaturalArmorModifier
 from statblock.base import Registry
 from statblock.base import ShieldModifier
 from statblock.base import SizeModifier
 from statblock.base import ValueModifier
 from statblock.base import calculate_modifier_sum
+from statblock.base import sum_buckets
 
-from statblock.skill import get_all_skill_classes
-from statblock.skill import Craft
-from statblock.skill import Perform
-from statblock.skill import Profession
+from statblock.skill import SKILLS
 
 from statblock.equipment import BodySlots
 
 
+# ids of the components every character has, skills aside
+ABILITIES = ("strength", "dexterity", "constitution", "intelligence",
+             "wisdom", "charisma")
+SAVES = ("fortitude", "reflex", "will")
+ATTACKS = ("attack/base", "attack/melee", "attack/ranged", "attack/grapple")
+ARMOR = ("armor-class", "natural-armor", "touch", "flat-footed")
+GENERAL = ("hit-points", "initiative")
+
+
 class Fortitude(Component):
     
     def __init__(self, initial=0):
@@ -76,10 +87,11 @@ class Initiative(Component):
 
 
 class SizeAttackModifier(Modifier):
+    __slots__ = ()
     stackable = True
     
     def __init__(self, source):
-        Modifier.__init__(self, source.value, source)
+        Modifier.__init__(self, source.attack, source)
         
     @property
     def value(self):
@@ -87,9 +99,10 @@ class SizeAttackModifier(Modifier):
     
 
 class SizeGrappleModifier(SizeModifier):
+    __slots__ = ()
 
     def __init__(self, source):
-        Modifier.__init__(self, source.value, source)
+        Modifier.__init__(self, source.grapple, source)
         
     @property
     def value(self):
@@ -98,24 +111,74 @@ class SizeGrappleModifier(SizeModifier):
         return inverted_malus + self.source.grapple
     
 
+class SizeCategory(namedtuple("SizeCategory", ["name", "attack", "grapple"])):
+    "A row of the size table, these are shared between all characters."
+    
+    def __str__(self):
+        return self.name
+    
+    def __repr__(self):
+        return "<Size.%s>" % self.name
+
+
+class Size(object):
+    FINE       = SizeCategory("Fine", +8, -16)
+    DIMINUTIVE = SizeCategory("Diminutive", +4, -12)
+    TINY       = SizeCategory("Tiny", +2, -8)
+    SMALL      = SizeCategory("Small", +1, -4)
+    MEDIUM     = SizeCategory("Medium", 0, 0)
+    LARGE      = SizeCategory("Large", -1, +4)
+    HUGE       = SizeCategory("Huge", -2, + 8)
+    GARGANTUAN = SizeCategory("Gargantuan", -4, +12)
+    COLLOSAL   = SizeCategory("Collossal", -8, +16)
+    
+    @classmethod
+    def named(cls, name):
+        "Looks up a size category by its name."
+        for category in vars(cls).values():
+            if isinstance(category, SizeCategory) and category.name == name:
+                return category
+        raise KeyError(name)
+    
+    
 class _Size(Component):
+    """
+    The size of one character. Its value is a row of the size table, 
+    setting another one only invalidates what depends on the size.
+    """
     
-    def __init__(self, name, attack, grapple):
+    def __init__(self, category=Size.MEDIUM):
         super(_Size, self).__init__("size")
-        self.name = name
-        self.attack = attack
-        self.grapple = grapple
+        self._category = category
         self._default_bonus = SizeAttackModifier(self)
         lb = LinkBuilder(self)
         lb.modifies("attack/base", "armor-class")
         lb.modifies("attack/grapple", bonus=SizeGrappleModifier(self))                                                              
     
+    @property
+    def name(self):
+        return self._category.name
+    
+    @property
+    def attack(self):
+        return self._category.attack
+    
+    @property
+    def grapple(self):
+        return self._category.grapple
+    
+    @property
+    def value(self):
+        return self._category
+    
+    @value.setter
+    def value(self, category):
+        self._category = getattr(category, "value", category)
+        self.invalidate()
+    
     def is_destroyable(self):
         return True
             
-    def is_modifiable(self):
-        return False
-            
     def __str__(self):
         return self.name
             
@@ -123,18 +186,6 @@ class _Size(Component):
         return "<Size.%s>" % self.name
 
 
-class Size(object):
-    FINE       = _Size("Fine", +8, -16)
-    DIMINUTIVE = _Size("Diminutive", +4, -12)
-    TINY       = _Size("Fine", +2, -8)
-    SMALL      = _Size("Small", +1, -4)
-    MEDIUM     = _Size("Medium", 0, 0)
-    LARGE      = _Size("Large", -1, +4)
-    HUGE       = _Size("Huge", -2, + 8)
-    GARGANTUAN = _Size("Gargantuan", -4, +12)
-    COLLOSAL   = _Size("Collossal", -8, +16)
-
-
 class BaseAttack(Component):
     
     def __init__(self, *args, **kwargs):
@@ -204,13 +255,14 @@ class FlatFooted(Component):
     def is_destroyable(self):
         return False
     
-    @property
-    def value(self):
-        mods = [m for m in self._modifiers if m.source.id is not "dexterity"]
+    def calculate(self):
+        mods = [m for m in self._modifiers 
+                if getattr(m.source, "id", None) != "dexterity"]
         return self._initial + calculate_modifier_sum(mods)
     
     
 class Touch(Component):
+    _armor = frozenset([ArmorModifier, NaturalArmorModifier, ShieldModifier])
     
     def __init__(self):
         super(Touch, self).__init__("touch", initial=10) 
@@ -219,17 +271,11 @@ class Touch(Component):
     def is_destroyable(self):
         return False
     
-    @property
-    def value(self):
-        mods = filter(self._no_armor, self._modifiers)
-        return self._initial + calculate_modifier_sum(mods)
-       
-    def _no_armor(self, m):
-        return type(m) not in set([
-           ArmorModifier, 
-           NaturalArmorModifier, 
-           ShieldModifier
-        ])
+    def calculate(self):
+        buckets = dict(
+            (k, b) for k, b in self._buckets.items() if k not in self._armor
+        )
+        return self._initial + sum_buckets(buckets)
 
 
 class MeleeAttackCombination(object):
@@ -246,58 +292,50 @@ class RangedAttackCombination(object):
 
 class Character(Actor):
 
-    def __init__(self, ability_default=10):
+    def __init__(self, ability_default=10, lazy_skills=False):
         super(Character, self).__init__()
         self.equipment = Registry()
         self.slots = BodySlots()
         
-        # adding abilities
-        self.registry.set(Strength(ability_default))
-        self.registry.set(Dexterity(ability_default))
-        self.registry.set(Constitution(ability_default))
-        self.registry.set(Intelligence(ability_default))
-        self.registry.set(Wisdom(ability_default))
-        self.registry.set(Charisma(ability_default))
-        
-        # adding saving throws
-        self.registry.set(Fortitude())
-        self.registry.set(Reflex())
-        self.registry.set(Will())
-        
-        # basic stuff
-        self.registry.set(HitPoints(8))
-        self.registry.set(Initiative())
-        self.registry.set(Size.MEDIUM)
-        
-        # attacks
+        # the standard components are registered at once, so their links 
+        # are put into the graph in one go
         self.attack = AttackModifierGroup()
-        self.attack.base = self.registry.set(BaseAttack(0))
-        self.attack.melee = self.registry.set(BaseMeleeAttack(0))
-        self.attack.ranged = self.registry.set(BaseRangedAttack(0))
-        self.attack.grapple = self.registry.set(GrappleAttack(0))
+        self.attack.base = BaseAttack(0)
+        self.attack.melee = BaseMeleeAttack(0)
+        self.attack.ranged = BaseRangedAttack(0)
+        self.attack.grapple = GrappleAttack(0)
+        components = [
+            # abilities
+            Strength(ability_default), Dexterity(ability_default), 
+            Constitution(ability_default), Intelligence(ability_default),
+            Wisdom(ability_default), Charisma(ability_default),
+            # saving throws
+            Fortitude(), Reflex(), Will(),
+            # basic stuff
+            HitPoints(8), Initiative(), _Size(),
+            # attacks
+            self.attack.base, self.attack.melee, self.attack.ranged, 
+            self.attack.grapple,
+            # armor
+            ArmorClass(10), NaturalArmor(0), Touch(), FlatFooted()
+        ]
         
-        # armor
-        self.registry.set(ArmorClass(10))
-        self.registry.set(NaturalArmor(0))
-        self.registry.set(Touch())
-        self.registry.set(FlatFooted())
-        
-        # skills, adding all found in the skill module
-        for cls in self._base_skills():
-            self.registry.set(cls())
+        # skills, adding all found in the skill module. Lazy skills are only
+        # created once they get ranks or modifiers.
+        if lazy_skills:
+            for info in SKILLS:
+                self.registry.defer(info.id, info)
+        else:
+            components.extend(info.create() for info in SKILLS)
+        self.registry.extend(components)
         
     def configure(self, id, value):
-        component = self.registry.get(id)
-        if component.is_modifiable():
-            component.value = value
-        else:
-            self.linker.remove(component)
-            self.registry.set(value)
-        self.connect_links()
+        self.registry.get(id).value = value
+        self.linker.process()
         
     def add_component(self, component):
         self.registry.set(component)
-        self.connect_links()
+        self.linker.process()
         
     def remove_component(self, thing):
         component = (thing if isinstance(thing, Component) 
@@ -319,18 +357,28 @@ class Character(Actor):
         if item.can_be_added(self.slots):
             self.slots.add(item)
             self.linker.apply(item)
-            self.linker.process_all()
             return True
         return False
         
     def deactivate_equipment(self, id):
         item = self.equipment.get(id)
         self.slots.remove(item)
-        self.linker.remove(self.equipment.get(id))
-        self.linker.process_all()
+        self.linker.remove(item)
         
     def connect_links(self):
         self.linker.process_all()
+        
+    @contextmanager
+    def batch(self):
+        """
+        Defers linking of all changes made inside the with-block to its end,
+        where everything affected is connected in a single pass.
+        """
+        self.linker.hold()
+        try:
+            yield self
+        finally:
+            self.linker.release()
     
     def __getattr__(self, name):
         if name in self.__dict__:
@@ -353,15 +401,34 @@ class Character(Actor):
             
     def _attribute_to_id(self, name):
         return name.lower().replace("_", "-")
-    
-    def _base_skills(self):
-        is_simple = lambda cls: cls not in (Craft, Perform, Profession)
-        return filter(is_simple, get_all_skill_classes())
             
     
 class ActorBuilder(object):
     
+    def __init__(self, lazy_skills=False):
+        self.lazy_skills = lazy_skills
+    
     def build(self):
-        actor = Character()
+        actor = Character(lazy_skills=self.lazy_skills)
         actor.connect_links()
         return actor
+
+
+class PrototypeBuilder(object):
+    """
+    Builds characters by copying a fully linked template character, which is
+    a lot cheaper than constructing and linking every one of them from
+    scratch. Later changes to the template are not picked up. The default
+    template has lazy skills, copying eager skills costs about as much as
+    building the character.
+    """
+    
+    def __init__(self, template=None):
+        if template is None:
+            template = ActorBuilder(lazy_skills=True).build()
+        # copies would otherwise each build the graph on their first change
+        template.linker.index()
+        self._prototype = Prototype(template)
+        
+    def build(self):
+        return self._prototype.create()
@@ -0,0 +1,163 @@
+"""
+Resolving attacks of a character's weapons against an armor class. A hit
+needs the d20 roll plus attack bonus to reach the armor class, a natural 1
+always misses and a natural 20 always hits. A hit with a natural roll in
+the weapon's critical range is a threat, confirmed by a second attack roll
+that hits as well. A critical hit rolls the damage 'multiplier' times.
+Every damage roll deals at least 1 point.
+"""
+import math
+
+from collections import namedtuple
+
+from statblock.dice import as_stream
+from statblock.dice import numpy
+
+
+MELEE = "melee"
+RANGED = "ranged"
+
+
+class AttackStatistics(namedtuple("AttackStatistics", [
+        "rounds", "hits", "criticals", "mean_damage", "damage_deviation",
+        "max_damage"])):
+    "Summary of simulated attack rounds"
+
+    @property
+    def hit_rate(self):
+        return self.hits / self.rounds
+
+    @property
+    def critical_rate(self):
+        return self.criticals / self.rounds
+
+
+def attack_profile(attacker, weapon, kind=MELEE):
+    """
+    Returns attack bonus, damage die, critical range and multiplier of a
+    weapon wielded by the attacker.
+    """
+    registry = attacker.registry
+    # another weapon of the same kind isn't linked to the attacker
+    if not registry.has(weapon.id) or registry.get(weapon.id) is not weapon:
+        raise ValueError("%s is not equipped by the attacker" % weapon.id)
+    return _weapon_profile(weapon, kind)
+
+
+def _weapon_profile(weapon, kind):
+    combat = weapon.ranged if kind == RANGED else weapon.melee
+    if combat.attack is None:
+        raise ValueError("%s can't be used for %s attacks" % (weapon.id, kind))
+    critical = weapon.critical
+    return combat.attack.value, combat.damage.value, critical.range, critical.multiplier
+
+
+def simulate_attacks(attacker, weapon, armor_class, rounds=10000, kind=MELEE,
+                     rng=None, batch_size=100000):
+    """
+    Simulates rounds of single attacks of the attacker with the weapon
+    against the armor class. The rounds are rolled in batches of batch_size
+    at once, or one by one without NumPy. rng is anything dice.as_stream()
+    accepts, pass a seeded stream for reproducible results.
+    """
+    if rounds < 1:
+        raise ValueError("rounds must be at least 1")
+    if batch_size < 1:
+        raise ValueError("batch_size must be at least 1")
+    bonus, damage, threat_range, multiplier = attack_profile(attacker, weapon, kind)
+    stream = as_stream(rng)
+    simulate = _simulate_batch if stream.generator is not None else _simulate_single
+
+    hits = criticals = 0
+    total = squares = maximum = 0
+    remaining = rounds
+    while remaining > 0:
+        n = min(batch_size, remaining)
+        remaining -= n
+        batch = simulate(stream, n, bonus, armor_class, damage, threat_range, multiplier)
+        hits += batch[0]
+        criticals += batch[1]
+        total += batch[2]
+        squares += batch[3]
+        maximum = max(maximum, batch[4])
+
+    mean = total / rounds
+    deviation = math.sqrt(max(squares / rounds - mean ** 2, 0))
+    return AttackStatistics(rounds, hits, criticals, mean, deviation, maximum)
+
+
+def expected_damage(weapon, armor_class, kind=MELEE):
+    """
+    The exact expected damage of a single attack with the weapon, using its
+    current attack bonus. armor_class is a single value or a sequence of
+    them, for which an array (a list without NumPy) of results is returned.
+    """
+    bonus, damage, threat_range, multiplier = _weapon_profile(weapon, kind)
+    mean = damage.distribution().at_least(1).mean
+    threats = [n for n in range(1, 21) if n in threat_range]
+
+    if numpy is None:
+        if not _is_sequence(armor_class):
+            return _expected_damage(bonus, armor_class, mean, threats, multiplier)
+        return [_expected_damage(bonus, ac, mean, threats, multiplier)
+                for ac in armor_class]
+
+    armor_class = numpy.asarray(armor_class)
+    naturals = numpy.arange(1, 21).reshape((20,) + (1,) * armor_class.ndim)
+    hits = _vector_hits(naturals, bonus, armor_class)
+    hit = hits.mean(axis=0)
+    threat = hits[numpy.asarray(threats) - 1].sum(axis=0) / 20.0
+    result = mean * (hit + threat * hit * (multiplier - 1))
+    return result if armor_class.ndim else float(result)
+
+
+def _expected_damage(bonus, armor_class, mean, threats, multiplier):
+    hit = sum(_hits(n, bonus, armor_class) for n in range(1, 21)) / 20.0
+    threat = sum(_hits(n, bonus, armor_class) for n in threats) / 20.0
+    return mean * (hit + threat * hit * (multiplier - 1))
+
+
+def _is_sequence(value):
+    return hasattr(value, "__iter__") and not isinstance(value, str)
+
+
+def _simulate_batch(stream, n, bonus, armor_class, damage, threat_range, multiplier):
+    natural = stream.integers(1, 21, size=(2, n))
+    attack, confirmation = natural[0], natural[1]
+    hit = _vector_hits(attack, bonus, armor_class)
+    critical = (hit & numpy.isin(attack, threat_range) &
+                _vector_hits(confirmation, bonus, armor_class))
+
+    dealt = numpy.maximum(damage.roll_many(n, stream), 1) * hit
+    if multiplier > 1:
+        extra = numpy.maximum(damage.roll_many(n * (multiplier - 1), stream), 1)
+        dealt += extra.reshape(n, multiplier - 1).sum(axis=1) * critical
+    return (int(hit.sum()), int(critical.sum()), int(dealt.sum()),
+            int((dealt.astype(numpy.float64) ** 2).sum()), int(dealt.max(initial=0)))
+
+
+def _simulate_single(stream, n, bonus, armor_class, damage, threat_range, multiplier):
+    hits = criticals = total = squares = maximum = 0
+    for _ in range(n):
+        natural = stream.randint(1, 20)
+        if not _hits(natural, bonus, armor_class):
+            continue
+        rolls = 1
+        if (natural in threat_range and
+                _hits(stream.randint(1, 20), bonus, armor_class)):
+            rolls = multiplier
+            criticals += 1
+        dealt = sum(max(damage.roll(stream), 1) for _ in range(rolls))
+        hits += 1
+        total += dealt
+        squares += dealt ** 2
+        maximum = max(maximum, dealt)
+    return hits, criticals, total, squares, maximum
+
+
+def _hits(natural, bonus, armor_class):
+    return natural == 20 or (natural != 1 and natural + bonus >= armor_class)
+
+
+def _vector_hits(natural, bonus, armor_class):
+    return (natural == 20) | ((natural != 1) & (natural + bonus >= armor_class))
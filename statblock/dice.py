@@ -1,4 +1,17 @@
-from random import random
+import bisect
+import itertools
+import math
+import random
+import re
+
+from collections import namedtuple
+from functools import lru_cache
+
+try:
+    import numpy
+except ImportError: # rolling many dice at once falls back to pure Python
+    numpy = None
+
 
 class Die:
     """
@@ -11,17 +24,34 @@ class Die:
         self.multiplicator = multiplicator
         self.modifier = modifier
         
-    def roll(self):
-        return self.multiplicator * random.choice(range(1, self.number + 1)) + self.modifier
+    def roll(self, rng=None):
+        return self.expression().roll(rng)
+    
+    def roll_many(self, n, rng=None):
+        """
+        Rolls the die n times at once and returns the results as NumPy array, 
+        or as list if NumPy is not installed. rng can be anything accepted
+        by as_stream(), a random.Random always gives a list.
+        """
+        return self.expression().roll_many(n, rng)
+    
+    def distribution(self):
+        "The exact probability distribution of the results of this die."
+        return self.expression().distribution()
+    
+    def expression(self):
+        "This die as compiled DiceExpression."
+        return _expression(self.number, self.multiplicator, self.modifier)
     
     def __rmul__(self, other):
         return Die(self.number, multiplicator=other, modifier=self.modifier)
     
     def __add__(self, other):
-        return Die(self.number, multiplicator=self.multiplicator, modifier=other)
+        return Die(self.number, multiplicator=self.multiplicator, 
+                   modifier=self.modifier + other)
     
-    def __call__(self):
-        return self.roll()
+    def __call__(self, rng=None):
+        return self.roll(rng)
     
     def __eq__(self, other):
         return (other.number       == self.number and 
@@ -30,16 +60,413 @@ class Die:
     
     @classmethod
     def parse(cls, text):
-        return cls.__new__()
+        """
+        Parses dice expressions like "3d6+2", "1d8+1d6+5", "4d6 drop lowest"
+        or "2d20 keep highest". A plain NdX+M is returned as Die, anything 
+        else as the compiled DiceExpression. Parsing results are cached.
+        """
+        expression = parse_dice(text)
+        return expression.as_die() or expression
     
     def __repr__(self):
         base = "%sd%s" % (self.multiplicator, self.number)
-        if self.modifier > 0:
-            return base + ("+%s" % self.modifier)
+        if self.modifier:
+            return base + ("%+i" % self.modifier)
         return base
+
+
+
+class Distribution(object):
+    """
+    Exact probability distribution of integer outcomes. It counts the ways 
+    to reach each outcome as integers, so combining distributions, e.g. by
+    adding them, is exact. Instances are immutable and can be shared.
+    """
     
-        
+    def __init__(self, counts, offset=0):
+        "counts[i] is the number of ways to get the outcome offset + i"
+        self._counts = tuple(counts)
+        self.offset = offset
+        self.total = sum(self._counts)
+        self._cumulative = None
+    
+    @classmethod
+    def uniform(cls, sides):
+        "The distribution of a single die with the given number of sides."
+        return cls([1] * sides, offset=1)
+    
+    @property
+    def minimum(self):
+        return self.offset
+    
+    @property
+    def maximum(self):
+        return self.offset + len(self._counts) - 1
+    
+    @property
+    def outcomes(self):
+        return range(self.minimum, self.maximum + 1)
+    
+    @property
+    def mean(self):
+        weighted = sum(c * v for v, c in zip(self.outcomes, self._counts))
+        return weighted / self.total
+    
+    @property
+    def variance(self):
+        mean = self.mean
+        squares = sum(c * (v - mean) ** 2 for v, c in zip(self.outcomes, self._counts))
+        return squares / self.total
+    
+    def pmf(self, value):
+        "Probability of getting exactly value."
+        if not self.minimum <= value <= self.maximum:
+            return 0.0
+        return self._counts[value - self.offset] / self.total
+    
+    def cdf(self, value):
+        "Probability of getting value or less."
+        if value < self.minimum:
+            return 0.0
+        if value >= self.maximum:
+            return 1.0
+        return self._cumulated()[math.floor(value) - self.offset] / self.total
+    
+    def percentile(self, p):
+        "The smallest outcome x with a cdf(x) of at least p."
+        if not 0 <= p <= 1:
+            raise ValueError("Percentile must be between 0 and 1")
+        index = bisect.bisect_left(self._cumulated(), p * self.total)
+        return self.offset + min(index, len(self._counts) - 1)
     
+    def at_least(self, lower):
+        "Distribution with all outcomes below lower counted as lower."
+        if lower <= self.minimum:
+            return self
+        if lower > self.maximum:
+            return Distribution([self.total], offset=lower)
+        cut = lower - self.offset
+        head = sum(self._counts[:cut + 1])
+        return Distribution((head,) + self._counts[cut + 1:], offset=lower)
+    
+    def repeat(self, n):
+        "Distribution of the sum of n independent outcomes of this one."
+        if n < 1:
+            return Distribution([1])
+        result, power = None, self
+        while n:
+            if n & 1:
+                result = power if result is None else result + power
+            n >>= 1
+            if n:
+                power = power + power
+        return result
+    
+    def _cumulated(self):
+        if self._cumulative is None:
+            running, cumulative = 0, []
+            for c in self._counts:
+                running += c
+                cumulative.append(running)
+            self._cumulative = cumulative
+        return self._cumulative
+    
+    def __add__(self, other):
+        if isinstance(other, int):
+            return Distribution(self._counts, offset=self.offset + other)
+        counts = [0] * (len(self._counts) + len(other._counts) - 1)
+        for i, a in enumerate(self._counts):
+            if a:
+                for j, b in enumerate(other._counts):
+                    counts[i + j] += a * b
+        return Distribution(counts, offset=self.offset + other.offset)
+    
+    def __radd__(self, other):
+        return self + other
+    
+    def __neg__(self):
+        return Distribution(reversed(self._counts), offset=-self.maximum)
+    
+    def __eq__(self, other):
+        return (isinstance(other, Distribution) and 
+                self.offset == other.offset and self._counts == other._counts)
+    
+    def __ne__(self, other):
+        return not self == other
+    
+    def __repr__(self):
+        return "<Distribution %s..%s, mean %.2f>" % (
+            self.minimum, self.maximum, self.mean
+        )
+
+
+class RandomStream(object):
+    """
+    Source of random numbers for rolling dice. A stream created with a seed 
+    always produces the same rolls, spawn() splits off independent streams,
+    e.g. one per worker process, that are reproducible as well. Bulk rolls 
+    use a NumPy Generator if NumPy is installed, single rolls Python's 
+    random.Random, both seeded from the same seed. Streams can be pickled.
+    """
+    
+    def __init__(self, seed=None):
+        if numpy is not None:
+            if isinstance(seed, numpy.random.SeedSequence):
+                self._sequence = seed
+            else:
+                self._sequence = numpy.random.SeedSequence(seed)
+            self.generator = numpy.random.default_rng(self._sequence)
+            state = self._sequence.generate_state(2, numpy.uint64)
+            self.python = random.Random(int(state[0]) << 64 | int(state[1]))
+        else:
+            self._sequence = None
+            self.generator = None
+            self.python = random.Random(seed)
+            
+    @classmethod
+    def wrap(cls, rng):
+        "Uses a NumPy Generator or a random.Random as stream."
+        stream = cls.__new__(cls)
+        stream._sequence = None
+        if isinstance(rng, random.Random):
+            stream.generator = None
+            stream.python = rng
+        else:
+            stream.generator = rng
+            stream.python = random.Random(int(rng.integers(2 ** 63)))
+        return stream
+            
+    def spawn(self, n):
+        "Returns n new streams independent of this one and of each other."
+        if self._sequence is not None:
+            return [RandomStream(s) for s in self._sequence.spawn(n)]
+        return [RandomStream(self.python.getrandbits(128)) for _ in range(n)]
+    
+    def randint(self, low, high):
+        return self.python.randint(low, high)
+    
+    def integers(self, low, high, size):
+        "Like Generator.integers, NumPy is needed for this."
+        return self.generator.integers(low, high, size=size)
+    
+    def choices(self, population, k):
+        return self.python.choices(population, k=k)
+    
+
+_default_stream = None
+
+
+def default_stream():
+    "The stream used when no rng is given, created on first use."
+    global _default_stream
+    if _default_stream is None:
+        _default_stream = RandomStream()
+    return _default_stream
+
+
+def seed(value=None):
+    "Starts the default stream over, seeded with the given value."
+    global _default_stream
+    _default_stream = RandomStream(value)
+    
+    
+def as_stream(rng=None):
+    """
+    Turns rng into a RandomStream. It can be None for the default stream, 
+    an int seed, a RandomStream, a NumPy Generator or a random.Random.
+    """
+    if rng is None:
+        return default_stream()
+    if isinstance(rng, RandomStream):
+        return rng
+    if isinstance(rng, int):
+        return RandomStream(rng)
+    return RandomStream.wrap(rng)
+
+
+class DiceGroup(namedtuple("DiceGroup", ["count", "sides", "keep", "highest", "sign"])):
+    """
+    A number of dice of the same kind rolled together, of which only 'keep' 
+    of the highest (or lowest) results count. A sign of -1 subtracts them.
+    """
+    
+    def select(self, rolls):
+        if self.keep >= self.count:
+            return sum(rolls)
+        rolls = sorted(rolls)
+        kept = rolls[self.count - self.keep:] if self.highest else rolls[:self.keep]
+        return sum(kept)
+    
+    def roll(self, stream):
+        return self.sign * self.select(
+            [stream.randint(1, self.sides) for _ in range(self.count)]
+        )
+    
+    def roll_many(self, n, stream):
+        "Returns an array of n results, the stream must have a NumPy Generator"
+        rolls = stream.integers(1, self.sides + 1, size=(n, self.count))
+        if self.keep < self.count:
+            rolls.sort(axis=1)
+            if self.highest:
+                rolls = rolls[:, self.count - self.keep:]
+            else:
+                rolls = rolls[:, :self.keep]
+        return self.sign * rolls.sum(axis=1)
+    
+    def distribution(self):
+        return _group_distribution(self)
+    
+    def __str__(self):
+        text = "%sd%s" % (self.count, self.sides)
+        if self.keep < self.count:
+            text += " keep %s %s" % (
+                "highest" if self.highest else "lowest", self.keep
+            )
+        return text
+    
+    
+class DiceExpression(namedtuple("DiceExpression", ["groups", "modifier"])):
+    """
+    A compiled dice expression, a sum of dice groups and a constant. Use 
+    parse_dice() or Die.parse() to create one.
+    """
+    
+    def roll(self, rng=None):
+        stream = as_stream(rng)
+        return sum(group.roll(stream) for group in self.groups) + self.modifier
+    
+    def roll_many(self, n, rng=None):
+        """
+        Rolls the expression n times, see Die.roll_many for the types of
+        rng and result.
+        """
+        stream = as_stream(rng)
+        if stream.generator is not None:
+            results = numpy.full(n, self.modifier, dtype=numpy.int64)
+            for group in self.groups:
+                results += group.roll_many(n, stream)
+            return results
+        if len(self.groups) == 1 and self.groups[0].keep == self.groups[0].count:
+            group = self.groups[0]
+            m, sign = group.count, group.sign
+            rolls = stream.choices(range(1, group.sides + 1), k=n * m)
+            return [sign * sum(rolls[i:i + m]) + self.modifier 
+                    for i in range(0, n * m, m)]
+        return [self.roll(stream) for _ in range(n)]
+    
+    def distribution(self):
+        "The exact probability distribution of the results."
+        return _expression_distribution(self)
+    
+    def as_die(self):
+        "Returns an equivalent Die if the expression is a plain NdX+M."
+        if len(self.groups) != 1:
+            return None
+        group = self.groups[0]
+        if group.sign < 0 or group.keep < group.count:
+            return None
+        return Die(group.sides, multiplicator=group.count, modifier=self.modifier)
+    
+    def __call__(self, rng=None):
+        return self.roll(rng)
+    
+    def __str__(self):
+        text = ""
+        for group in self.groups:
+            text += ("-" if group.sign < 0 else "+") + str(group)
+        if self.modifier or not self.groups:
+            text += "%+i" % self.modifier
+        return text.lstrip("+")
+    
+    
+_DICE_TERM = re.compile(r"""
+    \s*(?P<sign>[+-])?\s*
+    (?:
+        (?P<count>\d*)d(?P<sides>\d+)
+        (?:\s*(?P<selection>drop|keep|d|k)\s*(?P<which>lowest|highest|l|h)
+           (?:\s*(?P<amount>\d+))?)?
+      | (?P<constant>\d+)
+    )\s*""", re.VERBOSE)
+
+
+@lru_cache(maxsize=4096)
+def parse_dice(text):
+    """
+    Compiles a dice expression into a DiceExpression. Terms can be added or
+    subtracted; "drop lowest", "keep highest 3" and the short forms "dl",
+    "kh3" etc. select which dice of a group count.
+    """
+    source = text.strip().lower()
+    groups, modifier, position = [], 0, 0
+    while position < len(source):
+        match = _DICE_TERM.match(source, position)
+        if not match or match.end() == position:
+            raise ValueError("Can't parse dice expression %r" % text)
+        if position > 0 and not match.group("sign"):
+            raise ValueError("Missing operator in dice expression %r" % text)
+        position = match.end()
+        sign = -1 if match.group("sign") == "-" else +1
+        if match.group("constant"):
+            modifier += sign * int(match.group("constant"))
+            continue
+        groups.append(_dice_group(match, sign, text))
+    if not groups and position == 0:
+        raise ValueError("Empty dice expression %r" % text)
+    return DiceExpression(tuple(groups), modifier)
+
+
+def _dice_group(match, sign, text):
+    count = int(match.group("count") or 1)
+    sides = int(match.group("sides"))
+    if count < 1 or sides < 1:
+        raise ValueError("Invalid dice in expression %r" % text)
+    keep, highest = count, True
+    if match.group("selection"):
+        amount = int(match.group("amount") or 1)
+        drop = match.group("selection")[0] == "d"
+        lowest = match.group("which")[0] == "l"
+        keep = count - amount if drop else amount
+        highest = lowest if drop else not lowest
+        if not 0 < keep <= count:
+            raise ValueError("Can't keep %s of %s dice in %r" % (keep, count, text))
+    return DiceGroup(count, sides, keep, highest, sign)
+
+
+@lru_cache(maxsize=1024)
+def _expression(number, multiplicator, modifier):
+    return DiceExpression(
+        (DiceGroup(multiplicator, number, multiplicator, True, +1),), modifier
+    )
+
+
+@lru_cache(maxsize=1024)
+def _expression_distribution(expression):
+    return sum((group.distribution() for group in expression.groups), 
+               Distribution([1])) + expression.modifier
+
+
+@lru_cache(maxsize=1024)
+def _group_distribution(group):
+    if group.keep >= group.count:
+        dist = Distribution.uniform(group.sides).repeat(group.count)
+    else:
+        # go through all sorted combinations of rolls, each weighted by the 
+        # number of orders it can be rolled in
+        counts = {}
+        faces = range(1, group.sides + 1)
+        for rolls in itertools.combinations_with_replacement(faces, group.count):
+            orders = math.factorial(group.count)
+            for _, same in itertools.groupby(rolls):
+                orders //= math.factorial(len(list(same)))
+            total = group.select(rolls)
+            counts[total] = counts.get(total, 0) + orders
+        low = min(counts)
+        dist = Distribution(
+            [counts.get(v, 0) for v in range(low, max(counts) + 1)], offset=low
+        )
+    return -dist if group.sign < 0 else dist
+    
+
 d4 = Die(4)
 d6 = Die(6)
 d8 = Die(8)
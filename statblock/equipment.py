@@ -25,6 +25,14 @@ class BodySlots(object):
             self._items[slot] = item
         return True
     
+    def put(self, item, slots):
+        "Puts the item into the given slots, whether they are free or not."
+        for slot in slots:
+            self._items[slot] = item
+    
+    def slots_of(self, item):
+        return [slot for slot, used_item in self._items.items() if used_item is item]
+    
     def clear(self, slot):
         self._items[slot] = None
     
@@ -4,6 +4,7 @@ from statblock.base import Modifier
 
 
 class FeatModifier(Modifier):
+    __slots__ = ()
     
     def __init__(self, value, source):
         Modifier.__init__(self, value, source)
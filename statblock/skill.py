@@ -1,11 +1,15 @@
 import math
 
+from collections import namedtuple
+
 from statblock.base import Component
 from statblock.base import LinkBuilder
 from statblock.base import Modifier
+from statblock.base import ReverseLink
 
 
 class SkillModifier(Modifier):
+    __slots__ = ()
     stackable = True
     
     def __init__(self, skill):
@@ -17,6 +21,7 @@ class SkillModifier(Modifier):
         
 
 class SynergyModifier(Modifier):
+    __slots__ = ()
     stackable = True
     
     def __init__(self, skill):
@@ -56,7 +61,7 @@ class Skill(Component):
     def value(self, other):
         if (other % 0.5) != 0:
             raise Exception("Only fractions of 0.5 can be set as ranks")
-        self._initial = other
+        Component.value.fset(self, other)
         
     def __repr__(self):
         return "<%s: %s>" % (self.__class__.__name__, self.value)
@@ -679,8 +684,171 @@ class UseRope(Skill):
         return "Use Rope"
     
 
-def get_all_skill_classes():
-    """Convenience function to return all Skill classes in an iterable."""
+class SkillInfo(namedtuple("SkillInfo", [
+        "cls", "id", "name", "ability", "untrained", "armor_check_penalty", 
+        "synergies"])):
+    "Static description of a skill, the catalog is gathered on import."
+    
+    def create(self):
+        return self.cls()
+    
+    def view(self, registry):
+        return LazySkill(self, registry)
+    
+    @classmethod
+    def describe(cls, skill_class):
+        skill = skill_class()
+        ability = [l.source for l in skill.links if isinstance(l, ReverseLink)]
+        synergies = [l.target for l in skill.links 
+                     if isinstance(getattr(l, "modifier", None), SynergyModifier)]
+        return cls(skill_class, skill.id, skill.name, ability[0], 
+                   skill.untrained, skill.armor_check_penalty, 
+                   tuple(sorted(synergies)))
+
+
+class LazySkill(object):
+    """
+    Stands in for a skill nobody has put ranks into. Its value is calculated
+    from the key ability when asked for. Setting ranks or adding modifiers
+    creates the real skill component in the registry.
+    """
+    
+    def __init__(self, info, registry):
+        self.info = info
+        self._registry = registry
+    
+    @property
+    def id(self):
+        return self.info.id
+    
+    @property
+    def name(self):
+        return self.info.name
+    
+    @property
+    def untrained(self):
+        return self.info.untrained
+    
+    @property
+    def armor_check_penalty(self):
+        return self.info.armor_check_penalty
+    
+    @property
+    def links(self):
+        return frozenset()
+    
+    @property
+    def subcomponents(self):
+        return frozenset()
+    
+    @property
+    def component(self):
+        "The real skill once it has been created, None before."
+        if self._registry.is_deferred(self.id):
+            return None
+        return self._registry.get(self.id)
+    
+    @property
+    def bonus(self):
+        return self.materialize().bonus
+    
+    @property
+    def initial(self):
+        component = self.component
+        return 0 if component is None else component.initial
+    
+    @property
+    def version(self):
+        component = self.component
+        if component is not None:
+            return component.version
+        # the value only depends on the key ability
+        if not self._registry.has(self.info.ability):
+            return 0
+        return self._registry.get(self.info.ability).version
+    
+    @property
+    def ranks(self):
+        component = self.component
+        return 0 if component is None else component.ranks
+    
+    @ranks.setter
+    def ranks(self, new_value):
+        self.materialize().ranks = new_value
+    
+    @property
+    def value(self):
+        component = self.component
+        if component is not None:
+            return component.value
+        # synergies need 5 ranks in the source skill, which would have 
+        # materialized this skill already, so only the ability counts here
+        if not self._registry.has(self.info.ability):
+            return 0
+        return self._registry.get(self.info.ability).bonus.value
+    
+    @value.setter
+    def value(self, new_value):
+        self.materialize().value = new_value
+    
+    def update(self, *modifiers):
+        self.materialize().update(*modifiers)
+    
+    def remove(self, modifier):
+        component = self.component
+        if component is None:
+            raise KeyError(modifier)
+        component.remove(modifier)
+    
+    def is_modifiable(self):
+        return True
+    
+    def is_destroyable(self):
+        return False
+    
+    def materialize(self):
+        if self._registry.is_deferred(self.id):
+            return self._registry.materialize(self.id)
+        return self._registry.get(self.id)
+    
+    def __str__(self):
+        return str(self.value)
+    
+    def __repr__(self):
+        return "<%s: %s>" % (self.info.cls.__name__, self.value)
+    
+
+def _find_skill_classes():
     from inspect import getmembers, getmodule, isclass
     classes = getmembers(getmodule(Skill), isclass)
-    return [t[1] for t in classes if Skill in t[1].__bases__]
+    return tuple(t[1] for t in classes if Skill in t[1].__bases__)
+
+
+_SKILL_CLASSES = _find_skill_classes()
+
+# skills that need a qualifier like Craft (Armorsmithing) can't be described
+QUALIFIED_SKILLS = (Craft, Perform, Profession)
+
+SKILLS = tuple(SkillInfo.describe(cls) for cls in _SKILL_CLASSES 
+               if cls not in QUALIFIED_SKILLS)
+
+SKILLS_BY_ID = dict((info.id, info) for info in SKILLS)
+
+
+def get_all_skill_classes():
+    """Convenience function to return all Skill classes in an iterable."""
+    return list(_SKILL_CLASSES)
+
+
+def find_skills(untrained=None, armor_check_penalty=None, ability=None):
+    """
+    Returns the catalog entries of all simple skills matching the given 
+    criteria, in alphabetical order. armor_check_penalty only tells whether
+    a penalty applies at all.
+    """
+    return [info for info in SKILLS 
+        if (untrained is None or info.untrained == untrained) and
+           (armor_check_penalty is None or 
+                bool(info.armor_check_penalty) == armor_check_penalty) and
+           (ability is None or info.ability == ability)
+    ]
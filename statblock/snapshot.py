@@ -0,0 +1,223 @@
+"""
+A compact binary format for characters. A snapshot holds what can't be
+derived: the base values of the standard components, skill ranks, the
+size, added components like feats and weapons, the equipment and the
+slots the active items are worn in. Everything computed is rebuilt when
+loading.
+
+Components and items are stored by class and rebuilt by calling the class
+without arguments, or with the weapon they refer to (like WeaponFocus).
+Loading copies a linked template character of the same makeup, so only
+the base values get set on the copy.
+
+Layout (little endian), after the magic and a version byte:
+
+    size            B    index into SIZES
+    base values     i    one per id in BASE_VALUES
+    skills          H    count, then per skill: string id, h ranks * 2
+    components      H    count, then per component: string class,
+                         string id of the referred weapon ("" for none)
+    equipment       H    count, then per item: string class,
+                         B slot count, string per slot
+
+Strings are stored as B length and UTF-8 bytes.
+"""
+import struct
+
+from functools import lru_cache
+from importlib import import_module
+
+from statblock.base import Prototype
+from statblock.character import ABILITIES
+from statblock.character import ARMOR
+from statblock.character import ATTACKS
+from statblock.character import ActorBuilder
+from statblock.character import GENERAL
+from statblock.character import SAVES
+from statblock.character import Size
+from statblock.character import SizeCategory
+from statblock.skill import SKILLS_BY_ID
+
+
+MAGIC = b"SBLK"
+VERSION = 1
+
+BASE_VALUES = ABILITIES + SAVES + ATTACKS + ARMOR + GENERAL
+SIZES = tuple(sorted(
+    (c for c in vars(Size).values() if isinstance(c, SizeCategory)),
+    key=lambda c: c.grapple
+))
+
+_HEADER = struct.Struct("<4sBB")
+_BASE = struct.Struct("<%di" % len(BASE_VALUES))
+_COUNT = struct.Struct("<H")
+_BYTE = struct.Struct("<B")
+_RANKS = struct.Struct("<h")
+
+_STANDARD_IDS = None
+
+
+class SnapshotError(ValueError):
+    pass
+
+
+def _standard_ids():
+    global _STANDARD_IDS
+    if _STANDARD_IDS is None:
+        registry = ActorBuilder(lazy_skills=True).build().registry
+        _STANDARD_IDS = frozenset(c.id for c in registry.components)
+    return _STANDARD_IDS
+
+
+def _class_path(obj):
+    cls = type(obj)
+    return "%s:%s" % (cls.__module__, cls.__qualname__)
+
+
+@lru_cache(maxsize=None)
+def _resolve(path):
+    module, _, name = path.partition(":")
+    try:
+        return getattr(import_module(module), name)
+    except (ImportError, AttributeError):
+        raise SnapshotError("Unknown class %r" % path)
+
+
+def _pack_string(text):
+    data = text.encode("utf-8")
+    return _BYTE.pack(len(data)) + data
+
+
+def _extra_components(character):
+    "Components added to the character, weapons before what refers to them."
+    standard = _standard_ids()
+    extras = [c for c in character.registry.components
+              if c.id not in standard and c.id not in SKILLS_BY_ID]
+    children = set(child.id for c in extras for child in c.subcomponents)
+    extras = [c for c in extras if c.id not in children]
+    return sorted(extras, key=lambda c: _weapon_id(character, c) != "")
+
+
+def _weapon_id(character, component):
+    weapon = getattr(component, "weapon", None)
+    if weapon is not None and character.registry.has(getattr(weapon, "id", None)):
+        return weapon.id
+    return ""
+
+
+def dump(character):
+    "The snapshot of a character as bytes."
+    registry = character.registry
+    parts = [
+        _HEADER.pack(MAGIC, VERSION, SIZES.index(registry.get("size").value)),
+        _BASE.pack(*[registry.get(id).initial for id in BASE_VALUES])
+    ]
+
+    skills = [registry.get(id) for id in SKILLS_BY_ID]
+    skills = [skill for skill in skills if skill.ranks]
+    parts.append(_COUNT.pack(len(skills)))
+    for skill in skills:
+        parts.append(_pack_string(skill.id) + _RANKS.pack(int(skill.ranks * 2)))
+
+    extras = _extra_components(character)
+    parts.append(_COUNT.pack(len(extras)))
+    for component in extras:
+        parts.append(_pack_string(_class_path(component)))
+        parts.append(_pack_string(_weapon_id(character, component)))
+
+    items = list(character.equipment.components)
+    parts.append(_COUNT.pack(len(items)))
+    for item in items:
+        slots = character.slots.slots_of(item)
+        parts.append(_pack_string(_class_path(item)) + _BYTE.pack(len(slots)))
+        parts.extend(_pack_string(slot) for slot in slots)
+    return b"".join(parts)
+
+
+class _Reader(object):
+
+    def __init__(self, data):
+        self.data = data
+        self.position = 0
+
+    def unpack(self, layout):
+        values = layout.unpack_from(self.data, self.position)
+        self.position += layout.size
+        return values
+
+    def count(self):
+        return self.unpack(_COUNT)[0]
+
+    def string(self):
+        length = self.unpack(_BYTE)[0]
+        start = self.position
+        self.position += length
+        return self.data[start:self.position].decode("utf-8")
+
+
+def _read(data):
+    reader = _Reader(data)
+    try:
+        magic, version, size = reader.unpack(_HEADER)
+        if magic != MAGIC:
+            raise SnapshotError("Not a character snapshot")
+        if version != VERSION:
+            raise SnapshotError("Unsupported snapshot version %s" % version)
+        size = SIZES[size]
+        base = reader.unpack(_BASE)
+        skills = tuple(
+            (reader.string(), reader.unpack(_RANKS)[0] / 2.0)
+            for _ in range(reader.count())
+        )
+        components = tuple(
+            (reader.string(), reader.string()) for _ in range(reader.count())
+        )
+        equipment = []
+        for _ in range(reader.count()):
+            path = reader.string()
+            slots = tuple(reader.string() for _ in range(reader.unpack(_BYTE)[0]))
+            equipment.append((path, slots))
+    except (struct.error, UnicodeDecodeError, IndexError):
+        raise SnapshotError("Truncated or damaged snapshot")
+    # a string cut short reads past the end without failing
+    if reader.position != len(data):
+        raise SnapshotError("Truncated or damaged snapshot")
+    return size, base, skills, components, tuple(equipment)
+
+
+@lru_cache(maxsize=256)
+def _prototype(skill_ids, components, equipment):
+    "A prototype for all characters of the same makeup."
+    character = ActorBuilder(lazy_skills=True).build()
+    with character.batch():
+        for id in skill_ids:
+            if character.registry.is_deferred(id):
+                character.registry.materialize(id)
+        for path, weapon_id in components:
+            args = (character.registry.get(weapon_id),) if weapon_id else ()
+            character.add_component(_resolve(path)(*args))
+        for path, slots in equipment:
+            item = _resolve(path)()
+            character.add_equipment(item)
+            if slots:
+                character.slots.put(item, slots)
+                character.linker.apply(item)
+    character.linker.index()
+    return Prototype(character)
+
+
+def load(data):
+    "Rebuilds a character from a snapshot."
+    size, base, skills, components, equipment = _read(data)
+    skill_ids = tuple(id for id, _ in skills)
+    character = _prototype(skill_ids, components, equipment).create()
+    registry = character.registry
+    for id, value in zip(BASE_VALUES, base):
+        component = registry.get(id)
+        if component.initial != value:
+            component.value = value
+    for id, ranks in skills:
+        registry.get(id).value = int(ranks) if ranks.is_integer() else ranks
+    if size is not Size.MEDIUM:
+        registry.get("size").value = size
+    return character
@@ -0,0 +1,242 @@
+"""
+Columnar storage for the stats of many characters. Every column is a NumPy
+array keyed by a component id, so questions about a whole population are
+answered with array operations instead of walking every character.
+
+Derived columns can be recomputed from the base columns for all rows at
+once. The formulas mirror the links between the components: ability
+modifiers feed saves, attacks, armor class, initiative, hit points and
+skills, the size feeds attacks and armor class and skills with 5 or more
+ranks give their synergy bonuses. Everything else a character has, like
+feats or equipment, is kept as a residual per row, measured when the
+table is loaded.
+"""
+import numpy
+
+from statblock.character import ABILITIES
+from statblock.character import ARMOR
+from statblock.character import ATTACKS
+from statblock.character import GENERAL
+from statblock.character import SAVES
+from statblock.character import Size
+from statblock.skill import SKILLS
+
+
+SKILL_COLUMNS = tuple(info.id for info in SKILLS)
+
+COLUMNS = ABILITIES + SAVES + ATTACKS + ARMOR + GENERAL + SKILL_COLUMNS
+
+SIZE = "size"
+
+
+def _modifier(values, ability):
+    return (values[ability] - 10) // 2
+
+
+def _skill_formulas():
+    synergies = {}
+    for info in SKILLS:
+        for target in info.synergies:
+            synergies.setdefault(target, []).append(info.id)
+    
+    def skill(info):
+        def formula(values, base, size):
+            total = base[info.id] + _modifier(values, info.ability)
+            for source in synergies.get(info.id, ()):
+                total += 2 * (base[source] >= 5)
+            return total
+        return formula
+    return [(info.id, skill(info)) for info in SKILLS]
+
+
+def _base(id):
+    return lambda values, base, size: base[id].copy()
+
+
+# (column, formula) in dependency order, size is (attack, grapple) columns
+FORMULAS = [(id, _base(id)) for id in ABILITIES + ("natural-armor",)] + [
+    ("fortitude", lambda v, b, s: b["fortitude"] + _modifier(v, "constitution")),
+    ("reflex", lambda v, b, s: b["reflex"] + _modifier(v, "dexterity")),
+    ("will", lambda v, b, s: b["will"] + _modifier(v, "wisdom")),
+    ("hit-points", lambda v, b, s: b["hit-points"] + _modifier(v, "constitution")),
+    ("initiative", lambda v, b, s: b["initiative"] + _modifier(v, "dexterity")),
+    ("attack/base", lambda v, b, s: b["attack/base"] + s[0]),
+    ("attack/melee", lambda v, b, s: 
+        b["attack/melee"] + v["attack/base"] + _modifier(v, "strength")),
+    ("attack/ranged", lambda v, b, s: 
+        b["attack/ranged"] + v["attack/base"] + _modifier(v, "dexterity")),
+    ("attack/grapple", lambda v, b, s: 
+        b["attack/grapple"] + v["attack/base"] + _modifier(v, "strength") 
+        - s[0] + s[1]),
+    ("armor-class", lambda v, b, s: 
+        b["armor-class"] + _modifier(v, "dexterity") + s[0] + v["natural-armor"]),
+    ("touch", lambda v, b, s: b["touch"] + _modifier(v, "dexterity") + s[0]),
+    ("flat-footed", lambda v, b, s: b["flat-footed"] + s[0] + v["natural-armor"]),
+] + _skill_formulas()
+
+
+def _size_columns(names):
+    names = names.tolist()
+    categories = [Size.named(name) for name in set(names)]
+    index = dict((c.name, i) for i, c in enumerate(categories))
+    rows = numpy.fromiter(map(index.__getitem__, names), numpy.intp, len(names))
+    attack = numpy.array([c.attack for c in categories], dtype=numpy.int64)
+    grapple = numpy.array([c.grapple for c in categories], dtype=numpy.int64)
+    return attack[rows], grapple[rows]
+
+
+def _dtype(id):
+    # skill ranks come in steps of 0.5
+    return numpy.float64 if id.startswith("skill/") else numpy.int64
+
+
+class CharacterTable(object):
+    """
+    The computed values of many characters, one row per character. Next to
+    the computed value of a component its base value (the value before any
+    modifiers) is kept, which is what gets written back to characters.
+    After changing base columns or sizes, recompute() brings the derived
+    columns up to date.
+
+    A column is accessed with its id, table["touch"], the size column holds
+    the names of the size categories. Indexing with a boolean mask, a slice
+    or an array of positions returns a new table with the selected rows.
+    """
+
+    def __init__(self, values, base, size, residual=None):
+        self._values = values
+        self._base = base
+        self._size = size
+        if residual is None:
+            residual = self._residuals()
+        self._residual = residual
+
+    @classmethod
+    def from_characters(cls, characters, columns=COLUMNS):
+        characters = list(characters)
+        values = dict((id, numpy.empty(len(characters), _dtype(id))) for id in columns)
+        base = dict((id, numpy.empty(len(characters), _dtype(id))) for id in columns)
+        size = numpy.empty(len(characters), dtype=object)
+        for row, character in enumerate(characters):
+            registry = character.registry
+            for id in columns:
+                component = registry.get(id)
+                values[id][row] = component.value
+                base[id][row] = component.initial
+            size[row] = registry.get(SIZE).name
+        return cls(values, base, size)
+
+    @classmethod
+    def empty(cls, columns=COLUMNS):
+        return cls(
+            dict((id, numpy.empty(0, _dtype(id))) for id in columns),
+            dict((id, numpy.empty(0, _dtype(id))) for id in columns),
+            numpy.empty(0, dtype=object),
+            dict((id, numpy.empty(0, _dtype(id))) for id in columns)
+        )
+
+    @classmethod
+    def concatenate(cls, tables):
+        "Stacks the rows of tables with the same columns."
+        tables = list(tables)
+        if not tables:
+            return cls.empty()
+        
+        def stack(attribute):
+            return dict(
+                (id, numpy.concatenate([getattr(t, attribute)[id] for t in tables]))
+                for id in getattr(tables[0], attribute)
+            )
+        return cls(stack("_values"), stack("_base"),
+                   numpy.concatenate([t._size for t in tables]), stack("_residual"))
+
+    @property
+    def columns(self):
+        return tuple(self._values)
+
+    def base(self, id):
+        "The base values of a column."
+        return self._base[id]
+
+    def take(self, selection):
+        "A new table with the rows selected by a mask, slice or positions."
+        return CharacterTable(
+            dict((id, column[selection]) for id, column in self._values.items()),
+            dict((id, column[selection]) for id, column in self._base.items()),
+            self._size[selection],
+            dict((id, column[selection]) for id, column in self._residual.items())
+        )
+    
+    def residual(self, id):
+        "What the formulas don't explain in a column, e.g. equipment or feats."
+        return self._residual[id]
+    
+    def recompute(self):
+        """
+        Derives all columns from the base columns, sizes and residuals. Each
+        column needs the columns its formula refers to.
+        """
+        size = _size_columns(self._size)
+        values = dict(self._values)
+        for id, formula in FORMULAS:
+            if id in values:
+                column = formula(values, self._base, size)
+                column += self._residual[id]
+                values[id] = column
+        self._values = values
+    
+    def _residuals(self):
+        size = _size_columns(self._size)
+        residual = {}
+        for id, formula in FORMULAS:
+            if id in self._values:
+                residual[id] = self._values[id] - formula(self._values, self._base, size)
+        for id in self._values:
+            residual.setdefault(id, numpy.zeros_like(self._values[id]))
+        return residual
+
+    def row(self, index):
+        "The values of one row as dictionary."
+        values = dict((id, column[index].item()) for id, column in self._values.items())
+        values[SIZE] = self._size[index]
+        return values
+
+    def write_back(self, characters):
+        """
+        Sets the base values and sizes of the rows on the given characters,
+        which need to be in the same order as the rows. Computed values can't
+        be written, they follow from the base values on the characters.
+        """
+        characters = list(characters)
+        if len(characters) != len(self):
+            raise ValueError(
+                "Expected %s characters, got %s" % (len(self), len(characters))
+            )
+        base = dict((id, column.tolist()) for id, column in self._base.items())
+        for row, character in enumerate(characters):
+            registry = character.registry
+            with character.batch():
+                for id, column in base.items():
+                    value = column[row]
+                    if isinstance(value, float) and value.is_integer():
+                        value = int(value)
+                    if registry.get(id).initial != value:
+                        character.configure(id, value)
+                if registry.get(SIZE).name != self._size[row]:
+                    character.configure(SIZE, Size.named(self._size[row]))
+
+    def __len__(self):
+        return len(self._size)
+
+    def __contains__(self, id):
+        return id == SIZE or id in self._values
+
+    def __getitem__(self, key):
+        if isinstance(key, str):
+            return self._size if key == SIZE else self._values[key]
+        return self.take(key)
+
+    def __repr__(self):
+        return "<CharacterTable: %s rows, %s columns>" % (
+            len(self), len(self._values)
+        )
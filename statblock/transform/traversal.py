@@ -0,0 +1,230 @@
+"""
+Output formats besides XML. StatblockTraversal walks the sections of a
+statblock in the same order as the XML marshaller and reports them as
+events to a sink: start() and end() of mappings and lists, and value() for
+single values. Values are plain numbers and strings, so sinks don't need
+to know anything about components.
+"""
+import json
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+from statblock.character import ABILITIES
+
+
+def plain(value):
+    "The value of a component or modifier as number or string."
+    value = getattr(value, "value", value)
+    if value is None or isinstance(value, (bool, int, float, str)):
+        return value
+    return str(value)
+
+
+class StatblockTraversal(object):
+
+    def walk(self, character, sink):
+        sink.start(None, dict)
+        sink.value("name", character.name)
+        sink.value("gender", character.gender)
+        self.visit_type_info(character, sink)
+        sink.value("level", plain(character.level))
+        sink.value("alignment", character.alignment)
+        sink.value("size", str(character.size))
+        sink.value("initiative", plain(character.initiative))
+        self.visit_skills(character, sink)
+        self.visit_languages(character, sink)
+
+        self.visit_armor(character, sink)
+        sink.value("hit-points", plain(character.hit_points))
+        sink.value("hit-dice", "%s HD" % character.hit_dice.multiplicator)
+        self.visit_saving_throws(character, sink)
+
+        sink.value("speed", plain(character.speed))
+        self.visit_base_attacks(character, sink)
+        self.visit_attacks("melee", character.melee, sink)
+        self.visit_attacks("ranged", character.ranged, sink)
+
+        self.visit_abilities(character, sink)
+        self.visit_feats(character, sink)
+        self.visit_equipment(character, sink)
+        sink.end()
+
+    def visit_type_info(self, character, sink):
+        info = character.type_info
+        sink.start("type-info", dict)
+        sink.value("name", info.name)
+        sink.value("type", info.type)
+        sink.start("subtypes", list)
+        for subtype in info.subtypes:
+            sink.value(None, subtype)
+        sink.end()
+        sink.end()
+
+    def visit_skills(self, character, sink):
+        sink.start("skills", list)
+        for skill in character.skills:
+            sink.start(None, dict)
+            sink.value("name", skill.name)
+            sink.value("ranks", skill.ranks)
+            sink.value("value", plain(skill))
+            sink.end()
+        sink.end()
+
+    def visit_languages(self, character, sink):
+        sink.start("languages", list)
+        for language in character.languages:
+            sink.value(None, language)
+        sink.end()
+
+    def visit_armor(self, character, sink):
+        sink.start("armor-class", dict)
+        sink.value("value", plain(character.armor_class))
+        sink.value("touch", plain(character.touch))
+        sink.value("flat-footed", plain(character.flat_footed))
+        sink.end()
+
+    def visit_saving_throws(self, character, sink):
+        saves = character.saving_throws
+        sink.start("saving-throws", dict)
+        sink.value("fortitude", plain(saves.fortitude))
+        sink.value("reflex", plain(saves.reflex))
+        sink.value("will", plain(saves.will))
+        sink.end()
+
+    def visit_base_attacks(self, character, sink):
+        sink.start("attack", dict)
+        sink.value("base", plain(character.attack.base))
+        sink.value("grapple", plain(character.attack.grapple))
+        sink.end()
+
+    def visit_attacks(self, kind, attacks, sink):
+        sink.start(kind, list)
+        for attack in attacks:
+            sink.start(None, list)
+            for weapon in attack.weapons:
+                self.visit_weapon(weapon, kind, sink)
+            sink.end()
+        sink.end()
+
+    def visit_weapon(self, weapon, kind, sink):
+        combat = weapon.ranged if kind == "ranged" else weapon.melee
+        critical = weapon.critical
+        sink.start(None, dict)
+        sink.value("id", weapon.id)
+        sink.value("name", weapon.name)
+        sink.value("attack", plain(combat.attack))
+        sink.value("damage", plain(combat.damage))
+        if len(critical.range) > 1:
+            sink.value("critical", "%s-%s" % (critical.range[0], critical.range[-1]))
+        elif critical.multiplier > 1:
+            sink.value("critical", critical.multiplier)
+        sink.end()
+
+    def visit_abilities(self, character, sink):
+        abilities = character.abilities
+        sink.start("abilities", dict)
+        for name in ABILITIES:
+            sink.value(name, plain(getattr(abilities, name)))
+        sink.end()
+
+    def visit_feats(self, character, sink):
+        sink.start("feats", list)
+        for feat in character.feats:
+            sink.value(None, feat.name)
+        sink.end()
+
+    def visit_equipment(self, character, sink):
+        sink.start("equipment", list)
+        for item in character.equipment.components:
+            sink.start(None, dict)
+            sink.value("id", item.id)
+            sink.value("active", bool(character.slots.slots_of(item)))
+            sink.end()
+        sink.end()
+
+
+class DataSink(object):
+    "Collects the events of a traversal into dicts and lists."
+
+    def __init__(self):
+        self.result = None
+        self._stack = []
+
+    def start(self, key, container):
+        value = container()
+        self.value(key, value)
+        self._stack.append(value)
+
+    def end(self):
+        self._stack.pop()
+
+    def value(self, key, value):
+        if not self._stack:
+            self.result = value
+        elif key is None:
+            self._stack[-1].append(value)
+        else:
+            self._stack[-1][key] = value
+
+    def encode(self, data):
+        return data
+
+
+class JsonSink(DataSink):
+    "Encodes to JSON bytes, using orjson when it is installed."
+
+    def encode(self, data):
+        if orjson is not None:
+            return orjson.dumps(data)
+        return json.dumps(data, separators=(",", ":")).encode("utf-8")
+
+
+class MsgpackSink(DataSink):
+
+    def __init__(self):
+        if msgpack is None:
+            raise ImportError("msgpack is needed for msgpack output")
+        super(MsgpackSink, self).__init__()
+
+    def encode(self, data):
+        return msgpack.packb(data, use_bin_type=True)
+
+
+class StatblockTransformer(object):
+    """
+    Converts characters with the given sink class, like XmlTransformer
+    does for XML.
+    """
+
+    def __init__(self, sink=JsonSink, traversal=None):
+        self.sink = sink
+        self.traversal = traversal or StatblockTraversal()
+
+    def toData(self, character):
+        sink = self.sink()
+        self.traversal.walk(character, sink)
+        return sink.result
+
+    def dumps(self, character):
+        sink = self.sink()
+        self.traversal.walk(character, sink)
+        return sink.encode(sink.result)
+
+    def write(self, characters, output):
+        """
+        Writes the characters to a file opened for writing bytes, one
+        encoded statblock after the other. With JSON every statblock is a
+        line of its own (JSON lines), msgpack can read the objects back in
+        sequence with an Unpacker.
+        """
+        separator = b"\n" if issubclass(self.sink, JsonSink) else b""
+        for character in characters:
+            output.write(self.dumps(character) + separator)
@@ -1,17 +1,57 @@
+import codecs
+import os
+import threading
+
+from collections import OrderedDict
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from inspect import getmembers
+from inspect import isclass
+from itertools import islice
+
 from lxml import etree
 from lxml.builder import ElementMaker
 
+from statblock import armor
+from statblock import feat
+from statblock import weapon
+from statblock.base import Modifiable
+from statblock.base import Modifier
+from statblock.character import ABILITIES
+from statblock.character import PrototypeBuilder
+from statblock.character import Size
+from statblock.character import SizeCategory
+from statblock.dice import DiceExpression
+from statblock.dice import Die
+from statblock.equipment import Wearable
+from statblock.skill import SKILLS
+from statblock.skill import LazySkill
+
 
 class StatblockTypeMap(dict):
+    """
+    Lets ElementMaker take numbers and statblock objects as children. Newer
+    lxml versions copy the typemap into a plain dict, so the base classes
+    are registered as well, lxml looks them up along the mro.
+    """
+    
+    def __init__(self, *args, **kwargs):
+        super(StatblockTypeMap, self).__init__(*args, **kwargs)
+        for cls in (int, float, Modifiable, Modifier, LazySkill, SizeCategory, 
+                    Die, DiceExpression):
+            self.setdefault(cls, self.add_object_as_text)
     
     def add_object_as_text(self, elem, item):
-        "Transforms object to a string and delegates to ElementMaker's text handling"
-        self.get(str)(elem, str(item))
+        "Transforms object to a string, which ElementMaker adds as text"
+        return str(item)
     
     def __nonzero__(self):
         "Necessary to signify in if-checks that this dict is used"
         return True
     
+    __bool__ = __nonzero__
+    
     def copy(self):
         "Return a copy of itself, if not overridden dict.copy would be used"
         return StatblockTypeMap(self.items())
@@ -67,7 +107,7 @@ class XmlMarshaller():
             #--- fourth section --
             self.write_abilities(character),
             self.write_feats(character),
-            xml.equipment("")
+            self.write_equipment(character)
         )
         
         etree.cleanup_namespaces(root)
@@ -99,7 +139,8 @@ class XmlMarshaller():
     def write_skills(self, character):
         xml = self.element_maker
         return xml.skills(
-            *[xml.skill(xml.value(s), name=s.name) for s in character.skills]
+            *[xml.skill(xml.value(s), name=s.name, ranks=str(s.ranks)) 
+              for s in character.skills]
         )
     
     
@@ -162,7 +203,7 @@ class XmlMarshaller():
             xml.attack(combat.attack),
             xml.damage(combat.damage),
             critical,
-            id=weapon.id(),
+            id=weapon.id,
             name=weapon.name            
         )
     
@@ -186,16 +227,537 @@ class XmlMarshaller():
         )
     
 
+    def write_equipment(self, character):
+        xml = self.element_maker
+        return xml.equipment(
+            *[xml.item(id=item.id, active=str(bool(character.slots.slots_of(item))).lower())
+              for item in character.equipment.components]
+        )
+    
+
+def _element(tag, value=None, **attrib):
+    element = etree.Element(tag, attrib)
+    if value is not None:
+        element.text = str(value)
+    return element
+
+
+def _child(parent, tag, value=None, **attrib):
+    element = etree.SubElement(parent, tag, attrib)
+    if value is not None:
+        element.text = str(value)
+    return element
+
+
+class FastXmlMarshaller(XmlMarshaller):
+    """
+    Writes the same document as XmlMarshaller, but creates the elements
+    directly and turns values into text itself instead of dispatching every
+    value through ElementMaker's typemap.
+    """
+    
+    sections = ("description", "defense", "offense", "statistics")
+    
+    def marshal(self, character):
+        root = etree.Element("character")
+        for section in self.sections:
+            root.extend(getattr(self, "write_" + section)(character))
+        return root
+    
+    def write_description(self, character):
+        return [
+            _element("name", character.name),
+            _element("gender", character.gender),
+            self.write_type_info(character),
+            _element("level", character.level),
+            _element("alignment", character.alignment),
+            _element("size", character.size),
+            _element("initiative", character.initiative),
+            self.write_skills(character),
+            self.write_languages(character)
+        ]
+    
+    def write_defense(self, character):
+        return [
+            self.write_armor(character),
+            _element("hit-points", character.hit_points),
+            _element("hit-dice", self.format_hitdice(character.hit_dice)),
+            self.write_saving_throws(character)
+        ]
+    
+    def write_offense(self, character):
+        return [
+            _element("speed", character.speed),
+            self.write_base_attacks(character),
+            self.write_melee(character),
+            self.write_ranged(character)
+        ]
+    
+    def write_statistics(self, character):
+        return [
+            self.write_abilities(character),
+            self.write_feats(character),
+            self.write_equipment(character)
+        ]
+    
+    def write_languages(self, character):
+        languages = _element("languages")
+        for language in character.languages:
+            _child(languages, "language", language)
+        return languages
+    
+    def write_type_info(self, character):
+        info = character.type_info
+        element = _element("type-info")
+        _child(element, "name", info.name)
+        _child(element, "type", info.type)
+        subtypes = _child(element, "subtypes")
+        for subtype in info.subtypes:
+            _child(subtypes, "subtype", subtype)
+        return element
+    
+    def write_skills(self, character):
+        skills = _element("skills")
+        for skill in character.skills:
+            element = _child(skills, "skill", name=skill.name, ranks=str(skill.ranks))
+            _child(element, "value", skill)
+        return skills
+    
+    def write_armor(self, character):
+        element = _element("armor-class")
+        _child(element, "value", character.armor_class)
+        _child(element, "touch", character.touch)
+        _child(element, "flat-footed", character.flat_footed)
+        return element
+    
+    def write_saving_throws(self, character):
+        saves = character.saving_throws
+        element = _element("saving-throws")
+        _child(element, "fortitude", saves.fortitude)
+        _child(element, "reflex", saves.reflex)
+        _child(element, "will", saves.will)
+        return element
+    
+    def write_base_attacks(self, character):
+        element = _element("attack")
+        _child(element, "base", character.attack.base)
+        _child(element, "grapple", character.attack.grapple)
+        return element
+    
+    def write_weapon(self, weapon, kind):
+        combat = weapon.ranged if kind == "ranged" else weapon.melee
+        element = _element("weapon", id=weapon.id, name=weapon.name)
+        _child(element, "attack", combat.attack)
+        _child(element, "damage", combat.damage)
+        critical = weapon.critical
+        if len(critical.range) > 1:
+            _child(element, "critical", "%s-%s" % (critical.range[0], critical.range[-1]))
+        elif critical.multiplier > 1:
+            _child(element, "critical", critical.multiplier)
+        return element
+    
+    def write_abilities(self, character):
+        abilities = character.abilities
+        element = _element("abilities")
+        for name in ABILITIES:
+            _child(element, name, getattr(abilities, name))
+        return element
+    
+    def write_feats(self, character):
+        feats = _element("feats")
+        for feat in character.feats:
+            _child(feats, "feat", name=feat.name)
+        return feats
+    
+    def write_equipment(self, character):
+        equipment = _element("equipment")
+        for item in character.equipment.components:
+            active = "true" if character.slots.slots_of(item) else "false"
+            _child(equipment, "item", id=item.id, active=active)
+        return equipment
+
+
+def _stamp(value):
+    "What tells if a value has changed: versions of components, else itself."
+    if isinstance(value, LazySkill) and value.component is not None:
+        value = value.component
+    version = getattr(value, "version", None)
+    if version is None:
+        return value
+    identity = id(value) if isinstance(value, Modifiable) else None
+    return (type(value), getattr(value, "id", None), identity, version)
+
+
+class CachingXmlMarshaller(FastXmlMarshaller):
+    """
+    Keeps the serialized sections of the characters it has marshalled and 
+    rebuilds a section only if something it shows has changed since. The
+    components of a section are compared by their version, everything else
+    by value. Up to size characters are remembered.
+    """
+    
+    def __init__(self, size=1024):
+        super(CachingXmlMarshaller, self).__init__()
+        self.size = size
+        self.hits = 0
+        self.misses = 0
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+    
+    def marshal(self, character):
+        return etree.fromstring(self.serialize(character))
+    
+    def serialize(self, character):
+        "The pretty printed character element as bytes, like toXml()."
+        sections = self._sections(character)
+        parts = [b"<character>\n"]
+        for section in self.sections:
+            stamp = getattr(self, "stamp_" + section)(character)
+            cached = sections.get(section)
+            if cached is not None and cached[0] == stamp:
+                self._count(hits=1)
+            else:
+                self._count(misses=1)
+                elements = getattr(self, "write_" + section)(character)
+                cached = (stamp, self._pretty(elements))
+                sections[section] = cached
+            parts.append(cached[1])
+        parts.append(b"</character>\n")
+        return b"".join(parts)
+    
+    def forget(self, character):
+        with self._lock:
+            self._cache.pop(id(character), None)
+    
+    def _count(self, hits=0, misses=0):
+        with self._lock:
+            self.hits += hits
+            self.misses += misses
+    
+    def _pretty(self, elements):
+        # indented as children of the character element
+        root = etree.Element("character")
+        root.extend(elements)
+        data = etree.tostring(root, pretty_print=True)
+        return data[len(b"<character>\n"):-len(b"</character>\n")]
+    
+    def _sections(self, character):
+        # the character is kept with its sections, so its id can't be reused
+        key = id(character)
+        with self._lock:
+            entry = self._cache.get(key)
+            if entry is None:
+                entry = self._cache[key] = (character, {})
+                if len(self._cache) > self.size:
+                    self._cache.popitem(last=False)
+            else:
+                self._cache.move_to_end(key)
+            return entry[1]
+    
+    def stamp_description(self, character):
+        info = character.type_info
+        return (
+            character.name, character.gender, info.name, info.type, 
+            tuple(info.subtypes), _stamp(character.level), character.alignment,
+            _stamp(character.size), _stamp(character.initiative),
+            tuple((s.name, _stamp(s)) for s in character.skills),
+            tuple(character.languages)
+        )
+    
+    def stamp_defense(self, character):
+        saves = character.saving_throws
+        return (
+            _stamp(character.armor_class), _stamp(character.touch),
+            _stamp(character.flat_footed), _stamp(character.hit_points),
+            self.format_hitdice(character.hit_dice), _stamp(saves.fortitude),
+            _stamp(saves.reflex), _stamp(saves.will)
+        )
+    
+    def stamp_offense(self, character):
+        return (
+            _stamp(character.speed), _stamp(character.attack.base),
+            _stamp(character.attack.grapple),
+            self._stamp_attacks(character.melee, "melee"),
+            self._stamp_attacks(character.ranged, "ranged")
+        )
+    
+    def _stamp_attacks(self, attacks, kind):
+        stamps = []
+        for attack in attacks:
+            for weapon in attack.weapons:
+                combat = weapon.ranged if kind == "ranged" else weapon.melee
+                stamps.append((
+                    weapon.id, weapon.name, _stamp(combat.attack), 
+                    _stamp(combat.damage), tuple(weapon.critical.range),
+                    weapon.critical.multiplier
+                ))
+            stamps.append(None)
+        return tuple(stamps)
+    
+    def stamp_statistics(self, character):
+        abilities = character.abilities
+        return (
+            tuple(_stamp(getattr(abilities, name)) for name in ABILITIES),
+            tuple(feat.name for feat in character.feats),
+            tuple((item.id, bool(character.slots.slots_of(item))) 
+                  for item in character.equipment.components)
+        )
+
+
+def _instances(module, base, *args):
+    for _, cls in getmembers(module, isclass):
+        if not issubclass(cls, base) or cls.__module__ != module.__name__:
+            continue
+        try:
+            instance = cls(*args)
+        except (TypeError, AttributeError):
+            continue
+        if isinstance(instance.id, str):
+            yield cls, instance
+
+
+@lru_cache(maxsize=None)
+def _catalog():
+    "Classes of weapons, wearable items and feats found by id and name."
+    weapons = dict((w.id, cls) for cls, w in _instances(weapon, weapon.Weapon))
+    items = dict((i.id, cls) for cls, i in _instances(armor, Wearable))
+    feats = dict((f.name, (cls, None)) for cls, f in _instances(feat, feat.Feat))
+    for weapon_id, weapon_class in weapons.items():
+        # feats like Weapon Focus are taken for a particular weapon
+        for cls, f in _instances(feat, feat.Feat, weapon_class()):
+            feats.setdefault(f.name, (cls, weapon_id))
+    return weapons, items, feats
+
+
+_SKILLS_BY_NAME = dict((info.name, info) for info in SKILLS)
+
+
+class XmlUnmarshaller(object):
+    """
+    Rebuilds characters from <character> elements as written by the
+    marshaller. Read are the size, the abilities, the base attack, skill 
+    ranks, feats, the weapons of the melee and ranged attacks and the 
+    equipment. Other computed values in the document are ignored, except for
+    skills without a ranks attribute, whose ranks are derived from their 
+    value.
+    """
+    
+    def __init__(self, builder=None):
+        if builder is None:
+            builder = PrototypeBuilder()
+        self.builder = builder
+    
+    def unmarshal(self, element):
+        character = self.builder.build()
+        with character.batch():
+            self.read_size(character, element)
+            self.read_abilities(character, element)
+            self.read_weapons(character, element)
+            self.read_feats(character, element)
+            self.read_equipment(character, element)
+        # values in the document include the modifiers linked above
+        self.read_base_attack(character, element)
+        self.read_skills(character, element)
+        return character
+    
+    def read_size(self, character, element):
+        name = element.findtext("size")
+        if name:
+            try:
+                size = Size.named(name.strip())
+            except KeyError:
+                raise ValueError("Unknown size %r" % name.strip())
+            character.configure("size", size)
+    
+    def read_abilities(self, character, element):
+        for ability in element.iterfind("abilities/*"):
+            if ability.text and ability.text.strip():
+                character.configure(ability.tag, int(ability.text))
+    
+    def read_base_attack(self, character, element):
+        value = element.findtext("attack/base")
+        if value and value.strip():
+            # the size modifier is part of the written value
+            base = character.attack.base
+            character.configure("attack/base", 
+                                int(value) - base.value + base.initial)
+    
+    def read_skills(self, character, element):
+        derived = []
+        with character.batch():
+            for skill in element.iterfind("skills/skill"):
+                info = _SKILLS_BY_NAME.get(skill.get("name"))
+                if info is None:
+                    raise ValueError("Unknown skill %r" % skill.get("name"))
+                ranks = skill.get("ranks")
+                if ranks is None:
+                    derived.append((info, float(skill.findtext("value"))))
+                else:
+                    self._set_ranks(character, info, float(ranks))
+        # a value includes synergies from the ranks of other skills, which may
+        # be derived themselves. Each pass settles one more step of a chain.
+        for _ in range(len(derived)):
+            changed = False
+            with character.batch():
+                for info, value in derived:
+                    current = character.registry.get(info.id)
+                    ranks = value - current.value + current.ranks
+                    if ranks != current.ranks:
+                        self._set_ranks(character, info, ranks)
+                        changed = True
+            if not changed:
+                break
+    
+    def read_weapons(self, character, element):
+        weapons = _catalog()[0]
+        for weapon_id in element.xpath("(melee|ranged)//weapon/@id"):
+            if not character.registry.has(weapon_id):
+                character.add_component(self._create(weapons, weapon_id)())
+    
+    def read_feats(self, character, element):
+        feats = _catalog()[2]
+        for name in element.xpath("feats/feat/@name"):
+            cls, weapon_id = self._create(feats, name)
+            if weapon_id is None:
+                character.add_component(cls())
+                continue
+            if not character.registry.has(weapon_id):
+                character.add_component(_catalog()[0][weapon_id]())
+            character.add_component(cls(character.registry.get(weapon_id)))
+    
+    def read_equipment(self, character, element):
+        items = _catalog()[1]
+        for entry in element.iterfind("equipment/item"):
+            item = self._create(items, entry.get("id"))()
+            character.add_equipment(item)
+            if entry.get("active") == "true":
+                character.activate_equipment(item.id)
+    
+    def _set_ranks(self, character, info, ranks):
+        if ranks or not character.registry.is_deferred(info.id):
+            character.configure(info.id, int(ranks) if ranks.is_integer() else ranks)
+    
+    def _create(self, catalog, key):
+        try:
+            return catalog[key]
+        except KeyError:
+            raise ValueError("Unknown item %r" % key)
+
+
 class XmlTransformer(object):
     
-    def __init__(self):
-        self.marshaller = XmlMarshaller()
+    def __init__(self, marshaller=None):
+        self.marshaller = marshaller or XmlMarshaller()
+        self._unmarshaller = None
+    
+    @property
+    def unmarshaller(self):
+        # only created when reading, it builds a template character
+        if self._unmarshaller is None:
+            self._unmarshaller = XmlUnmarshaller()
+        return self._unmarshaller
+    
+    @unmarshaller.setter
+    def unmarshaller(self, unmarshaller):
+        self._unmarshaller = unmarshaller
     
     def toXml(self, character):
-        element = self.toElement(character)
-        return etree.tostring(element, pretty_print=True)
+        return self._document(character)
     
     def toElement(self, character):                    
         return self.marshaller.marshal(character)
     
-    
\ No newline at end of file
+    def fromXml(self, text):
+        return self.unmarshaller.unmarshal(etree.fromstring(text))
+    
+    def read(self, source, tag="character"):
+        """
+        Yields the characters of a document one by one. source is a file
+        name or a file opened for reading bytes. Every element is cleared
+        after it has been read, so large documents aren't kept in memory.
+        """
+        for _, element in etree.iterparse(source, events=("end",), tag=tag):
+            yield self.unmarshaller.unmarshal(element)
+            element.clear()
+            while element.getprevious() is not None:
+                del element.getparent()[0]
+    
+    def write(self, characters, output, root="characters", encoding="utf-8"):
+        """
+        Streams any number of characters into a single document with the
+        given root element. output is a file name or a file opened for 
+        writing bytes. Only the element of one character is held in memory
+        at a time, it is written as soon as it has been marshalled.
+        """
+        if self._serializes(encoding):
+            # xmlfile would escape the bytes, they are written as they are
+            chunks = ([self._document(c, encoding)] for c in characters)
+            self._write_output(chunks, output, root, encoding)
+            return
+        with etree.xmlfile(output, encoding=encoding) as xf:
+            xf.write_declaration()
+            with xf.element(root):
+                xf.write("\n")
+                for character in characters:
+                    xf.write(self.toElement(character), pretty_print=True)
+    
+    def export(self, characters, output=None, workers=None, chunk_size=100,
+               root="characters", encoding="utf-8"):
+        """
+        Serializes many characters in chunks of chunk_size on a pool of
+        worker threads. Without output the pretty printed documents of the
+        characters are returned as a list of bytes, otherwise they are 
+        written to output (a file name or a file opened for writing bytes)
+        as one document like write() does. Either way the characters keep
+        their order. The marshaller is shared by the threads.
+        """
+        if chunk_size < 1:
+            raise ValueError("chunk_size must be at least 1")
+        chunks = self._export_chunks(characters, workers, chunk_size, encoding)
+        if output is None:
+            return [data for chunk in chunks for data in chunk]
+        self._write_output(chunks, output, root, encoding)
+    
+    def _serializes(self, encoding):
+        # the serialized bytes use character references beyond ascii
+        return (hasattr(self.marshaller, "serialize") and 
+                codecs.lookup(encoding).name in ("ascii", "utf-8"))
+    
+    def _document(self, character, encoding=None):
+        if self._serializes(encoding or "ascii"):
+            return self.marshaller.serialize(character)
+        return etree.tostring(self.toElement(character), pretty_print=True,
+                              encoding=encoding, xml_declaration=False)
+    
+    def _serialize(self, characters, encoding):
+        return [self._document(character, encoding) for character in characters]
+    
+    def _export_chunks(self, characters, workers, chunk_size, encoding):
+        characters = iter(characters)
+        workers = workers or os.cpu_count() or 1
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            # only a few chunks ahead of the one being consumed
+            pending = deque()
+            while True:
+                chunk = list(islice(characters, chunk_size))
+                if not chunk:
+                    break
+                if len(pending) >= 2 * workers:
+                    yield pending.popleft().result()
+                pending.append(executor.submit(self._serialize, chunk, encoding))
+            while pending:
+                yield pending.popleft().result()
+    
+    def _write_output(self, chunks, output, root, encoding):
+        if isinstance(output, str):
+            with open(output, "wb") as stream:
+                self._write_chunks(chunks, stream, root, encoding)
+        else:
+            self._write_chunks(chunks, output, root, encoding)
+    
+    def _write_chunks(self, chunks, stream, root, encoding):
+        header = "<?xml version='1.0' encoding='%s'?>\n<%s>\n" % (encoding, root)
+        stream.write(header.encode(encoding))
+        for chunk in chunks:
+            stream.write(b"".join(chunk))
+        stream.write(("</%s>" % root).encode(encoding))
@@ -48,14 +48,15 @@ class RangedAttack(Attack):
 
 
 class Damage(Component):
+    # every caller gets a die of its own
+    cached = False
     
     def __init__(self, id, default, type):
         super(Damage, self).__init__(id)
         self.default = default
         self.type = type
     
-    @property
-    def value(self):
+    def calculate(self):
         "The value of a damage is the combined dice roll with modifiers."
         return Die(
             self.default.number, 
@@ -1,8 +1,15 @@
 import pytest
 
 from statblock.base import EnhancementModifier
+from statblock.base import Link
 from statblock.base import Modifiable
+from statblock.base import Prototype
+from statblock.base import ReverseLink
+from statblock.base import SizeModifier
 from statblock.base import UntypedModifier
+from statblock.base import UseLink
+from statblock.base import calculate_modifier_sum
+from statblock.base import ValueModifier
 
 
 # a simple mock
@@ -30,6 +37,110 @@ def test_calculate_stackable_modifiers():
     assert s.value == sum(vals)
 
 
+def test_value_is_cached_until_modifiers_change():
+    s = Sword(0)
+    s.update(UntypedModifier(1))
+    assert s.value == 1
+    s._initial = 5 # bypassing the setter does not invalidate the cache
+    assert s.value == 1
+    s.update(UntypedModifier(2))
+    assert s.value == 8
+    
+    
+def test_changed_source_invalidates_dependents():
+    source = Sword(2)
+    target = Sword(0)
+    target.update(ValueModifier(source))
+    assert target.value == 2
+    source.value = 5
+    assert target.value == 5
+    target.remove(ValueModifier(source))
+    assert target.value == 0
+    assert target not in source._dependents
+
+
+def test_modifiers_and_links_have_no_instance_dict():
+    source = Sword(2)
+    for obj in (UntypedModifier(1), ValueModifier(source), 
+                Link("a", "b", UntypedModifier(1)), ReverseLink("a", "b"), 
+                UseLink("a", "b")):
+        assert not hasattr(obj, "__dict__")
+        
+        
+def test_modifiers_without_source_are_distinct():
+    first, second = EnhancementModifier(+1), EnhancementModifier(+1)
+    assert first.source is None
+    assert first == first
+    assert first != second
+    assert len(set([first, second])) == 2
+    assert ValueModifier(Sword(1)) != ValueModifier(Sword(1))
+
+
+def test_non_stacking_modifiers_of_a_type_only_count_once():
+    mods = [EnhancementModifier(i) for i in (1, 3, 2)] + \
+           [UntypedModifier(i) for i in (1, 1)] + \
+           [SizeModifier(i) for i in (-1, -2)]
+    for order in (mods, list(reversed(mods)), mods[::2] + mods[1::2]):
+        s = Sword(10)
+        s.update(*order)
+        assert s.value == 10 + 3 + 2 - 1
+        assert calculate_modifier_sum(order) == 4
+        
+        
+def test_removing_modifier_updates_its_type():
+    best, other = EnhancementModifier(3), EnhancementModifier(1)
+    s = Sword(0)
+    s.update(best, other)
+    assert s.value == 3
+    s.remove(best)
+    assert s.value == 1
+    s.remove(other)
+    assert s.value == 0
+    assert s._buckets == {}
+
+
+
+def test_buckets_are_kept_up_to_date_after_the_first_read():
+    s = Sword(0)
+    s.update(EnhancementModifier(1))
+    assert s.value == 1
+    def regroup():
+        raise AssertionError("modifiers should not be regrouped")
+    s._group = regroup
+    best, size = EnhancementModifier(3), SizeModifier(-1)
+    s.update(best, size)
+    assert s.value == 2
+    s.remove(best)
+    assert s.value == 0
+    assert set(s._buckets) == set([EnhancementModifier, SizeModifier])
+
+
+
+class Node(object):
+    __slots__ = ("name", "parent", "children")
+    
+
+def test_prototype_copies_nested_containers():
+    root = Sword(1)
+    child = Node()
+    child.name, child.parent, child.children = "child", root, []
+    root.nodes = {"child": child, "all": [child, "x"], "sets": [set([child])]}
+    root.pair = (1, 2)
+    root.update(UntypedModifier(2), ValueModifier(root))
+    prototype = Prototype(root)
+    
+    first, second = prototype.create(), prototype.create()
+    assert first is not second and first is not root
+    copy = first.nodes["child"]
+    assert type(copy) is Node and copy is not child
+    assert copy.parent is first and copy.name == "child"
+    assert first.nodes["all"] == [copy, "x"]
+    assert first.nodes["sets"] == [set([copy])]
+    assert first.pair is root.pair
+    assert ValueModifier(first) in first._modifiers
+    assert second.nodes["child"] is not copy
+
+
 if __name__ == '__main__':
     import sys
     pytest.main(["-s", "-v"] + sys.argv[1:] + [__file__])
@@ -0,0 +1,66 @@
+import pytest
+
+pytest.importorskip("numpy")
+
+from statblock.armor import ChainMail
+from statblock.batch import BuildSpec
+from statblock.batch import build_characters
+from statblock.batch import generate
+from statblock.batch import iter_batches
+from statblock.character import Size
+from statblock.snapshot import load
+from statblock.weapon import Longsword
+
+
+SPEC = BuildSpec(
+    abilities={"strength": "4d6 drop lowest", "dexterity": [10, 14], "constitution": 13},
+    size="Large",
+    skills={"skill/bluff": 5},
+    feats=[Longsword],
+    equipment=[ChainMail]
+)
+
+
+def test_characters_follow_the_spec():
+    for character in build_characters(SPEC, 5, rng=1):
+        assert 3 <= character.strength.value <= 18
+        assert character.dexterity.value in (10, 14)
+        assert character.constitution.value == 13
+        assert character.size.value == Size.LARGE
+        assert character.registry.get("skill/diplomacy").value == 2
+        assert character.registry.has("weapon/longsword")
+        dexterity = (character.dexterity.value - 10) // 2
+        assert character.armor_class.value == 10 + 5 - 1 + dexterity
+
+
+def test_chunks_are_reproducible_and_in_order():
+    chunks = list(iter_batches(SPEC, 7, seed=3, chunk_size=3, workers=0))
+    assert [len(chunk) for chunk in chunks] == [3, 3, 1]
+    table = generate(SPEC, 7, seed=3, chunk_size=3, workers=0)
+    assert len(table) == 7
+    assert list(table["strength"][:3]) == list(chunks[0]["strength"])
+    assert set(table["size"]) == set(["Large"])
+    assert list(table.residual("armor-class")) == [5] * 7
+
+
+def test_process_pool_gives_the_same_rows():
+    inline = generate(SPEC, 6, seed=3, chunk_size=2, workers=0)
+    pooled = generate(SPEC, 6, seed=3, chunk_size=2, workers=2, max_pending=1)
+    assert list(inline["strength"]) == list(pooled["strength"])
+    assert list(inline["attack/melee"]) == list(pooled["attack/melee"])
+
+
+def test_snapshot_output():
+    table = generate(SPEC, 3, seed=4, workers=0)
+    snapshots = generate(SPEC, 3, output="snapshot", seed=4, workers=0)
+    assert [load(s).strength.value for s in snapshots] == list(table["strength"])
+
+
+def test_unknown_output():
+    with pytest.raises(ValueError):
+        generate(SPEC, 1, output="xml", workers=0)
+
+
+if __name__ == '__main__':
+    import sys
+    pytest.main(["-s", "-v"] + sys.argv[1:] + [__file__])
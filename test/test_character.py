@@ -1,9 +1,16 @@
 from statblock.ability import Strength
+from statblock.armor import ChainMail
+from statblock.armor import HeavySteelShield
+from statblock.character import ABILITIES
 from statblock.character import ActorBuilder
 from statblock.character import Character
+from statblock.character import PrototypeBuilder
 from statblock.character import Size
+from statblock.character import SizeCategory
 from statblock.dice import d4, d8
 from statblock.feat import WeaponFocus
+from statblock.skill import LazySkill
+from statblock.skill import SKILLS
 from statblock.weapon import Longsword
 from statblock.weapon import Dagger
 
@@ -67,7 +74,7 @@ def test_grapple_attack():
     guard.attack.base.value += 3
     guard.strength = 16
     guard.configure("size", Size.LARGE)
-    assert guard.size == Size.LARGE
+    assert guard.size.value == Size.LARGE
     assert guard.attack.grapple.value == 10
     
 
@@ -80,6 +87,27 @@ def test_size_effects():
     guard.size = Size.MEDIUM
     assert guard.attack.base.value == 0
     assert guard.armor_class.value == 10
+    
+
+def test_size_changes_do_not_touch_other_characters():
+    guard, other = ActorBuilder().build(), ActorBuilder().build()
+    other.attack.base.value = 2
+    before = [other.attack.base.value, other.attack.grapple.value, 
+              other.armor_class.value]
+    
+    guard.configure("size", Size.LARGE)
+    assert guard.size.value is Size.LARGE
+    assert guard.attack.grapple.value == 4
+    assert other.size.value is Size.MEDIUM
+    assert [other.attack.base.value, other.attack.grapple.value, 
+            other.armor_class.value] == before
+    
+
+def test_size_names():
+    assert Size.TINY.name == "Tiny"
+    assert Size.named("Tiny") is Size.TINY
+    assert len(set(c.name for c in vars(Size).values() 
+                   if isinstance(c, SizeCategory))) == 9
  
  
 def test_adding_a_weapon():
@@ -118,6 +146,136 @@ def test_that_vital_objects_like_dexterity_can_not_be_destroyed():
     assert guard.registry.has("skill/jump")
     
 
+def test_skill_values_follow_ability_changes():
+    guard = ActorBuilder().build()
+    hide = guard.registry.get("skill/hide")
+    assert hide.value == 0
+    guard.dexterity = 14
+    assert hide.value == 2
+    assert guard.touch.value == 12
+    assert guard.flat_footed.value == 10
+    guard.dexterity = 8
+    assert hide.value == -1
+    assert guard.touch.value == 9
+    
+
+def test_setting_values_does_not_relink():
+    guard = ActorBuilder().build()
+    connected = []
+    guard.linker._connect = connected.append
+    guard.configure("skill/jump", 4)
+    guard.strength = 14
+    assert connected == []
+    assert guard.registry.get("skill/jump").value == 6
+
+
+def test_adding_component_relinks_only_downstream():
+    guard = ActorBuilder().build()
+    guard.add_component(ChainMail())
+    affected = guard.linker.downstream(["armor/chain-mail"])
+    assert set(affected) == set([
+        "armor/chain-mail", "armor-class", "touch", "flat-footed"
+    ])
+    assert guard.armor_class.value == 15
+    assert guard.flat_footed.value == 15
+    assert guard.touch.value == 10
+    
+
+def test_deactivated_equipment_is_removed_from_dependent_components():
+    guard = ActorBuilder().build()
+    shield = HeavySteelShield()
+    guard.add_equipment(shield)
+    guard.activate_equipment(shield.id)
+    assert guard.flat_footed.value == 12
+    guard.deactivate_equipment(shield.id)
+    assert guard.armor_class.value == 10
+    assert guard.flat_footed.value == 10
+    
+
+def test_batch_connects_each_link_once():
+    guard = ActorBuilder().build()
+    connect_all = guard.linker._connect_all
+    connected = []
+    def counting_connect_all(target, links):
+        connected.extend(links)
+        connect_all(target, links)
+    guard.linker._connect_all = counting_connect_all
+    
+    with guard.batch():
+        guard.dexterity = 14
+        guard.add_component(ChainMail())
+        guard.add_component(HeavySteelShield())
+        guard.size = Size.LARGE
+        assert connected == []
+    
+    assert connected
+    assert len(connected) == len(set(connected))
+    assert guard.armor_class.value == 18
+    assert guard.flat_footed.value == 16
+    assert guard.touch.value == 11
+    
+
+def test_prototype_copies_are_independent():
+    template = ActorBuilder().build()
+    template.strength = 14
+    builder = PrototypeBuilder(template)
+    first, second = builder.build(), builder.build()
+    
+    first.dexterity = 14
+    first.add_component(ChainMail())
+    assert first.armor_class.value == 17
+    assert first.attack.melee.value == 2
+    assert first.registry.get("skill/hide").value == 2
+    
+    assert second.armor_class.value == 10
+    assert second.registry.get("skill/hide").value == 0
+    assert template.armor_class.value == 10
+    assert not template.registry.has("armor/chain-mail")
+    
+    second.size = Size.LARGE
+    assert second.attack.base.value == -1
+    assert first.attack.base.value == 0
+    
+
+def test_building_does_no_work_for_values_never_read():
+    character = ActorBuilder().build()
+    ids = ABILITIES + tuple(info.id for info in SKILLS)
+    components = [character.registry.get(id) for id in ids]
+    assert all(c.version == 0 for c in components)
+    assert not any(c._dependents for c in components)
+    assert character.linker._unindexed
+    
+    dexterity = character.registry.get("dexterity")
+    assert character.registry.get("skill/hide").value == 0
+    assert dexterity._dependents
+    character.dexterity = 14
+    assert character.registry.get("skill/hide").value == 2
+    assert character.registry.get("skill/hide").version == 1
+    assert character.linker.downstream(["dexterity"])
+    
+
+def test_prototype_copies_carry_the_link_graph():
+    builder = PrototypeBuilder(ActorBuilder().build())
+    character = builder.build()
+    assert not character.linker._unindexed
+    character.add_component(ChainMail())
+    assert character.armor_class.value == 15
+    assert character.touch.value == 10
+
+
+def test_prototype_builder_copies_lazy_skills_by_default():
+    character = PrototypeBuilder().build()
+    assert isinstance(character.registry.get("skill/hide"), LazySkill)
+    character.dexterity = 14
+    character.configure("skill/jump", 5)
+    eager = ActorBuilder().build()
+    eager.dexterity = 14
+    eager.configure("skill/jump", 5)
+    for info in SKILLS:
+        assert character.registry.get(info.id).value == \
+               eager.registry.get(info.id).value
+
+
 if __name__ == '__main__':
     import pytest, sys
     pytest.main(["-s", "-v"] + sys.argv[1:] + [__file__])
\ No newline at end of file
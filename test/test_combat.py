@@ -0,0 +1,94 @@
+import random
+
+import pytest
+
+from statblock.character import ActorBuilder
+from statblock import combat
+from statblock.combat import expected_damage
+from statblock.combat import simulate_attacks
+from statblock.weapon import Longsword
+
+
+def armed_fighter():
+    fighter = ActorBuilder().build()
+    fighter.strength = 16
+    sword = Longsword()
+    fighter.add_component(sword)
+    return fighter, sword
+
+
+def test_unequipped_weapon_is_rejected():
+    fighter = ActorBuilder().build()
+    with pytest.raises(ValueError):
+        simulate_attacks(fighter, Longsword(), 15)
+    
+    fighter, sword = armed_fighter()
+    with pytest.raises(ValueError):
+        simulate_attacks(fighter, Longsword(), 15)
+
+
+def test_simulating_without_rounds_is_rejected():
+    fighter, sword = armed_fighter()
+    with pytest.raises(ValueError):
+        simulate_attacks(fighter, sword, 15, rounds=0)
+    with pytest.raises(ValueError):
+        simulate_attacks(fighter, sword, 15, rounds=10, batch_size=0)
+
+
+def test_seeded_simulations_are_reproducible():
+    pytest.importorskip("numpy")
+    fighter, sword = armed_fighter()
+    first = simulate_attacks(fighter, sword, 15, rounds=5000, rng=3)
+    second = simulate_attacks(fighter, sword, 15, rounds=5000, rng=3)
+    assert first.rounds == 5000
+    assert first == second
+
+
+def test_natural_rolls_decide_against_extreme_armor_class():
+    fighter, sword = armed_fighter()
+    for rng in (1, random.Random(1)):
+        always = simulate_attacks(fighter, sword, -100, rounds=4000, rng=rng)
+        assert 0.93 < always.hit_rate < 0.97
+        never = simulate_attacks(fighter, sword, 100, rounds=4000, rng=rng)
+        assert 0.03 < never.hit_rate < 0.07
+        assert never.critical_rate < never.hit_rate
+
+
+def test_damage_statistics():
+    fighter, sword = armed_fighter()
+    stats = simulate_attacks(fighter, sword, -100, rounds=20000, rng=7)
+    # d8+3, a 10% threat range confirmed 95% of the time doubles the damage
+    expected = 0.95 * 7.5 + 0.095 * 7.5
+    assert stats.mean_damage == pytest.approx(expected, rel=0.05)
+    assert stats.max_damage <= 22
+    assert stats.damage_deviation > 0
+
+
+def test_expected_damage_for_single_armor_class():
+    fighter, sword = armed_fighter()
+    # attack +3 hits AC 15 on 12-20, threats on 19-20, d8+3 averages 7.5
+    assert expected_damage(sword, 15) == pytest.approx(7.5 * (0.45 + 0.1 * 0.45))
+    # only natural 20s hit, and confirm
+    assert expected_damage(sword, 40) == pytest.approx(7.5 * (0.05 + 0.05 * 0.05))
+
+
+def test_expected_damage_sweep_matches_single_values():
+    pytest.importorskip("numpy")
+    fighter, sword = armed_fighter()
+    sweep = expected_damage(sword, range(10, 41))
+    assert sweep.shape == (31,)
+    assert list(sweep) == pytest.approx([expected_damage(sword, ac) for ac in range(10, 41)])
+    assert all(sweep[:-1] >= sweep[1:])
+
+
+def test_expected_damage_without_numpy(monkeypatch):
+    fighter, sword = armed_fighter()
+    single = expected_damage(sword, 15)
+    monkeypatch.setattr(combat, "numpy", None)
+    assert expected_damage(sword, [15, 16]) == pytest.approx(
+        [single, 7.5 * (0.4 + 0.1 * 0.4)])
+
+
+if __name__ == '__main__':
+    import sys
+    pytest.main(["-s", "-v"] + sys.argv[1:] + [__file__])
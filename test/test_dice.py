@@ -0,0 +1,164 @@
+import pickle
+import random
+
+import pytest
+
+from statblock import dice
+from statblock.dice import DiceExpression
+from statblock.dice import Die
+from statblock.dice import RandomStream
+from statblock.dice import parse_dice
+from statblock.dice import d6, d8, d20
+
+
+def test_building_dice():
+    assert 2 * d8 + 4 == Die(8, multiplicator=2, modifier=4)
+    assert d8 + 1 + 2 == Die(8, modifier=3)
+    assert repr(2 * d6 + 3) == "2d6+3"
+    assert repr(d6 + -1) == "1d6-1"
+    
+    
+def test_roll_sums_all_dice():
+    results = set((3 * d6 + 2).roll() for _ in range(2000))
+    assert min(results) == 5
+    assert max(results) == 20
+    
+    
+def test_roll_many_with_numpy():
+    numpy = pytest.importorskip("numpy")
+    rolls = (2 * d8 + 4).roll_many(10000, rng=numpy.random.default_rng(1))
+    assert rolls.shape == (10000,)
+    assert rolls.min() == 6
+    assert rolls.max() == 20
+    assert abs(rolls.mean() - 13) < 0.2
+    
+    
+def test_roll_many_without_numpy(monkeypatch):
+    monkeypatch.setattr(dice, "numpy", None)
+    monkeypatch.setattr(dice, "_default_stream", None)
+    rolls = (2 * d8 + 4).roll_many(10000)
+    assert isinstance(rolls, list)
+    assert min(rolls) == 6
+    assert max(rolls) == 20
+    
+    
+def test_roll_many_with_python_random_is_reproducible():
+    first = (3 * d6).roll_many(50, rng=random.Random(7))
+    second = (3 * d6).roll_many(50, rng=random.Random(7))
+    assert first == second
+    assert len(first) == 50
+
+
+def test_seeded_streams_are_reproducible():
+    pytest.importorskip("numpy")
+    first, second = RandomStream(42), RandomStream(42)
+    assert d6.roll_many(20, first).tolist() == d6.roll_many(20, second).tolist()
+    assert [d20.roll(first) for _ in range(20)] == \
+           [d20.roll(second) for _ in range(20)]
+    assert d6.roll_many(20, 7).tolist() == d6.roll_many(20, 7).tolist()
+    
+    
+def test_spawned_streams_are_independent_and_reproducible():
+    pytest.importorskip("numpy")
+    children = RandomStream(3).spawn(2)
+    again = RandomStream(3).spawn(2)
+    rolls = [d20.roll_many(50, c).tolist() for c in children]
+    assert rolls[0] != rolls[1]
+    assert rolls == [d20.roll_many(50, c).tolist() for c in again]
+    
+    
+def test_streams_without_numpy_are_reproducible(monkeypatch):
+    monkeypatch.setattr(dice, "numpy", None)
+    first, second = RandomStream(5), RandomStream(5)
+    assert first.generator is None
+    assert (2 * d6).roll_many(30, first) == (2 * d6).roll_many(30, second)
+    assert parse_dice("4d6 drop lowest").roll_many(10, first.spawn(1)[0]) == \
+           parse_dice("4d6 drop lowest").roll_many(10, second.spawn(1)[0])
+    
+    
+def test_streams_can_be_pickled():
+    pytest.importorskip("numpy")
+    stream = RandomStream(11)
+    copy = pickle.loads(pickle.dumps(stream))
+    assert d8.roll_many(10, stream).tolist() == d8.roll_many(10, copy).tolist()
+    
+    
+def test_seeding_default_stream():
+    pytest.importorskip("numpy")
+    dice.seed(99)
+    first = (3 * d6).roll_many(10)
+    dice.seed(99)
+    assert (3 * d6).roll_many(10).tolist() == first.tolist()
+
+
+def test_distribution_of_die():
+    dist = (2 * d8 + 4).distribution()
+    assert (dist.minimum, dist.maximum) == (6, 20)
+    assert dist.mean == 13
+    assert dist.variance == 2 * (8 ** 2 - 1) / 12.0
+    assert dist.pmf(13) == 8 / 64.0
+    assert dist.pmf(5) == 0
+    assert dist.cdf(6) == 1 / 64.0
+    assert dist.cdf(20) == 1
+    assert dist.percentile(0.5) == 13
+    assert dist.percentile(1) == 20
+    assert sum(dist.pmf(v) for v in dist.outcomes) == pytest.approx(1)
+
+
+def test_distribution_cdf_between_outcomes():
+    dist = -d6.distribution()
+    assert dist.cdf(-2.5) == pytest.approx(4 / 6.0)
+    assert dist.cdf(-3) == pytest.approx(4 / 6.0)
+    assert d6.distribution().cdf(3.5) == pytest.approx(3 / 6.0)
+    assert dist.percentile(4 / 6.0) == -3
+    
+    
+def test_distributions_are_cached_and_combinable():
+    assert (3 * d6).distribution() is (3 * d6).distribution()
+    combined = d8.distribution() + d6.distribution() + 5
+    assert combined.mean == 4.5 + 3.5 + 5
+    assert combined == (d6.distribution() + d8.distribution() + 5)
+    
+
+def test_distribution_with_lower_bound():
+    dist = (d6 + -3).distribution().at_least(1)
+    assert dist.minimum == 1
+    assert dist.pmf(1) == 4 / 6.0
+    assert dist.mean == 1.5
+
+
+def test_parse_plain_dice():
+    assert Die.parse("3d6+2") == 3 * d6 + 2
+    assert Die.parse(" d8 ") == d8
+    assert Die.parse("2d8 - 1") == 2 * d8 + -1
+    
+    
+def test_parse_compound_expressions():
+    expression = Die.parse("1d8+1d6+5")
+    assert isinstance(expression, DiceExpression)
+    assert expression.distribution() == \
+        d8.distribution() + d6.distribution() + 5
+    assert str(expression) == "1d8+1d6+5"
+    assert 7 <= expression.roll() <= 19
+    assert parse_dice("1d8+1d6+5") is parse_dice("1d8+1d6+5")
+    
+    
+def test_parse_keep_and_drop():
+    assert parse_dice("4d6 drop lowest") == parse_dice("4d6 keep highest 3")
+    assert parse_dice("4d6dl") == parse_dice("4D6 KH3")
+    assert parse_dice("2d20 keep highest").distribution().mean == 13.825
+    assert parse_dice("2d20 keep lowest").distribution().mean == 7.175
+    assert parse_dice("4d6 drop lowest").distribution().maximum == 18
+    results = parse_dice("4d6 drop lowest").roll_many(500)
+    assert min(results) >= 3 and max(results) <= 18
+    
+    
+@pytest.mark.parametrize("text", ["", "3x6", "2d6 3", "4d6 drop lowest 4", "d0"])
+def test_parse_invalid_expressions(text):
+    with pytest.raises(ValueError):
+        parse_dice(text)
+
+
+if __name__ == '__main__':
+    import sys
+    pytest.main(["-s", "-v"] + sys.argv[1:] + [__file__])
@@ -1,8 +1,15 @@
 import pytest
 
+from statblock.base import Modifier
 from statblock.character import ActorBuilder
 from statblock.skill import Balance
+from statblock.skill import QUALIFIED_SKILLS
+from statblock.skill import SKILLS
+from statblock.skill import SKILLS_BY_ID
+from statblock.skill import find_skills
+from statblock.skill import get_all_skill_classes
 from statblock.skill import Jump
+from statblock.skill import LazySkill
 from statblock.skill import Skill
 from statblock.skill import Tumble
 
@@ -44,6 +51,88 @@ def test_armor_check_penalty_applies():
     assert balance.armor_check_penalty == 1
     
 
+def test_skill_catalog():
+    assert [info.cls for info in SKILLS] == [
+        cls for cls in get_all_skill_classes() if cls not in QUALIFIED_SKILLS
+    ]
+    tumble = SKILLS_BY_ID["skill/tumble"]
+    assert tumble.cls is Tumble
+    assert tumble.ability == "dexterity"
+    assert not tumble.untrained
+    assert tumble.synergies == ("skill/balance", "skill/jump")
+    
+    
+def test_filtering_skill_catalog():
+    penalized = find_skills(ability="strength", armor_check_penalty=True)
+    assert [info.id for info in penalized] == [
+        "skill/climb", "skill/jump", "skill/swim"
+    ]
+    assert all(info.untrained for info in find_skills(untrained=True))
+    assert Balance in [info.cls for info in find_skills(untrained=True)]
+    
+
+def test_lazy_skills_are_created_when_changed():
+    character = ActorBuilder(lazy_skills=True).build()
+    character.dexterity = 14
+    character.strength = 8
+    
+    hide = character.registry.get("skill/hide")
+    assert isinstance(hide, LazySkill)
+    assert hide.value == 2
+    assert not any(isinstance(c, Skill) for c in character.registry.components)
+    
+    character.configure("skill/jump", 5)
+    jump = character.registry.get("skill/jump")
+    assert isinstance(jump, Jump)
+    assert jump.value == 4
+    
+    # the synergy bonus of jump turns tumble into a real skill as well
+    tumble = character.registry.get("skill/tumble")
+    assert isinstance(tumble, Tumble)
+    assert tumble.value == 4
+    assert isinstance(character.registry.get("skill/hide"), LazySkill)
+    
+    
+def test_lazy_and_eager_skills_have_same_values():
+    eager = ActorBuilder().build()
+    lazy = ActorBuilder(lazy_skills=True).build()
+    for character in (eager, lazy):
+        character.wisdom = 15
+        character.configure("skill/sense-motive", 6)
+        character.configure("skill/bluff", 2.5)
+    for info in SKILLS:
+        assert eager.registry.get(info.id).value == \
+               lazy.registry.get(info.id).value
+
+
+
+def test_lazy_skill_views_follow_the_real_skill():
+    character = ActorBuilder(lazy_skills=True).build()
+    character.dexterity = 14
+    hide = character.registry.get("skill/hide")
+    tumble = character.registry.get("skill/tumble")
+    
+    hide.ranks = 4
+    assert hide.ranks == 4
+    assert hide.value == 6 == character.registry.get("skill/hide").value
+    assert hide.initial == 4
+    
+    modifier = Modifier(1)
+    hide.update(modifier)
+    assert hide.value == 7
+    hide.remove(modifier)
+    assert hide.value == 6
+    
+    version = hide.version
+    character.dexterity = 16
+    assert hide.version > version
+    assert hide.value == 7
+    
+    character.configure("skill/tumble", 2)
+    assert tumble.ranks == 2
+    assert tumble.value == 5
+    
+
 if __name__ == '__main__':
     import sys
     pytest.main(["-s", "-v"] + sys.argv[1:] + [__file__])
\ No newline at end of file
@@ -0,0 +1,75 @@
+import pytest
+
+from statblock.armor import ChainMail
+from statblock.armor import HeavySteelShield
+from statblock.character import ActorBuilder
+from statblock.character import Size
+from statblock.feat import ImprovedInitiative
+from statblock.feat import WeaponFocus
+from statblock.snapshot import SnapshotError
+from statblock.snapshot import dump
+from statblock.snapshot import load
+from statblock.weapon import Longsword
+
+
+def fighter():
+    character = ActorBuilder(lazy_skills=True).build()
+    character.strength = 17
+    character.dexterity = 13
+    character.size = Size.LARGE
+    character.registry.get("skill/bluff").ranks = 5.5
+    sword = Longsword()
+    character.add_component(sword)
+    character.add_component(WeaponFocus(sword))
+    character.add_component(ImprovedInitiative())
+    character.add_equipment(ChainMail())
+    character.add_equipment(HeavySteelShield())
+    character.activate_equipment("armor/chain-mail")
+    return character
+
+
+def test_round_trip_keeps_values():
+    original = fighter()
+    copy = load(dump(original))
+    for id in ("strength", "attack/melee", "armor-class", "flat-footed",
+               "touch", "initiative", "skill/bluff", "skill/diplomacy",
+               "weapon/longsword/melee/attack"):
+        assert copy.registry.get(id).value == original.registry.get(id).value, id
+    assert copy.size.value == Size.LARGE
+    assert copy.slots.get("body").id == "armor/chain-mail"
+    assert copy.slots.get("left-hand") is None
+    assert copy.equipment.has("shield/heavy-steel-shield")
+
+
+def test_loaded_characters_are_independent():
+    data = dump(fighter())
+    first, second = load(data), load(data)
+    first.strength = 10
+    assert first.attack.melee.value == -1
+    assert second.attack.melee.value == 2
+    assert second.registry.get("weapon/longsword/melee/attack").value == 3
+
+
+def test_plain_characters_are_small():
+    data = dump(ActorBuilder().build())
+    assert len(data) < 100
+    assert load(data).armor_class.value == 10
+
+
+def test_damaged_snapshots():
+    data = dump(fighter())
+    with pytest.raises(SnapshotError):
+        load(b"XXXX" + data[4:])
+    with pytest.raises(SnapshotError):
+        load(data[:-3])
+    with pytest.raises(SnapshotError):
+        load(data[:4] + b"\x09" + data[5:])
+    with pytest.raises(SnapshotError):
+        load(data[:5] + b"\xff" + data[6:])
+    with pytest.raises(SnapshotError):
+        load(data + b"\x00")
+
+
+if __name__ == '__main__':
+    import sys
+    pytest.main(["-s", "-v"] + sys.argv[1:] + [__file__])
@@ -0,0 +1,93 @@
+import pytest
+
+numpy = pytest.importorskip("numpy")
+
+from statblock.armor import ChainMail
+from statblock.character import ActorBuilder
+from statblock.character import Size
+from statblock.table import CharacterTable
+
+
+def population():
+    characters = [ActorBuilder(lazy_skills=True).build() for _ in range(4)]
+    for i, character in enumerate(characters):
+        character.dexterity = 10 + 2 * i
+        character.registry.get("skill/hide").ranks = i
+    characters[1].size = Size.SMALL
+    return characters
+
+
+def test_columns_hold_computed_and_base_values():
+    table = CharacterTable.from_characters(population())
+    assert len(table) == 4
+    assert list(table["dexterity"]) == [10, 12, 14, 16]
+    assert list(table["touch"]) == [10, 12, 12, 13]
+    assert list(table["skill/hide"]) == [0, 2, 4, 6]
+    assert list(table.base("skill/hide")) == [0, 1, 2, 3]
+    assert list(table["size"]) == ["Medium", "Small", "Medium", "Medium"]
+
+
+def test_filtering_returns_tables():
+    table = CharacterTable.from_characters(population())
+    nimble = table[table["dexterity"] > 12]
+    assert len(nimble) == 2
+    assert list(nimble.base("dexterity")) == [14, 16]
+    assert nimble.row(0)["reflex"] == 2
+    assert table["touch"].sum() == 47
+
+
+def test_write_back_changes_characters():
+    characters = population()
+    table = CharacterTable.from_characters(characters)
+    table.base("strength")[:] = 14
+    table.base("skill/climb")[2] = 2.5
+    table["size"][0] = "Large"
+    table.write_back(characters)
+
+    assert all(c.strength.value == 14 for c in characters)
+    assert characters[0].attack.melee.value == 1
+    assert characters[0].armor_class.value == 9
+    assert characters[2].registry.get("skill/climb").value == 4.5
+    assert list(CharacterTable.from_characters(characters)["attack/melee"]) == [1, 3, 2, 2]
+
+
+def test_write_back_needs_a_character_per_row():
+    characters = population()
+    table = CharacterTable.from_characters(characters)
+    with pytest.raises(ValueError):
+        table.write_back(characters[:2])
+
+
+def test_residuals_keep_what_formulas_do_not_cover():
+    characters = population()
+    characters[3].add_equipment(ChainMail())
+    characters[3].activate_equipment(ChainMail().id)
+    table = CharacterTable.from_characters(characters)
+    assert list(table.residual("armor-class")) == [0, 0, 0, 5]
+    assert list(table.residual("touch")) == [0, 0, 0, 0]
+
+
+def test_recompute_matches_characters():
+    characters = population()
+    characters[3].add_equipment(ChainMail())
+    characters[3].activate_equipment(ChainMail().id)
+    table = CharacterTable.from_characters(characters)
+
+    table["size"][2] = "Large"
+    table.base("strength")[table["size"] == "Large"] += 2
+    table.base("dexterity")[:] += 3
+    table.base("skill/bluff")[1:] = 5
+    table.base("natural-armor")[0] = 2
+    table.recompute()
+    assert list(table["attack/melee"]) == [0, 1, 0, 0]
+    assert list(table["skill/diplomacy"]) == [0, 2, 2, 2]
+
+    table.write_back(characters)
+    reloaded = CharacterTable.from_characters(characters)
+    for id in table.columns:
+        assert list(table[id]) == list(reloaded[id]), id
+
+
+if __name__ == '__main__':
+    import sys
+    pytest.main(["-s", "-v"] + sys.argv[1:] + [__file__])
@@ -0,0 +1,55 @@
+import io
+import json
+
+import pytest
+
+from statblock.transform.traversal import DataSink
+from statblock.transform.traversal import JsonSink
+from statblock.transform.traversal import MsgpackSink
+from statblock.transform.traversal import StatblockTransformer
+from statblock.transform import traversal
+
+from test.transform.test_xml import statblock
+
+
+def test_traversal_reports_plain_values():
+    data = StatblockTransformer(DataSink).toData(statblock())
+    assert data["size"] == "Medium"
+    assert data["abilities"]["strength"] == 16
+    assert data["armor-class"] == {"value": 16, "touch": 11, "flat-footed": 15}
+    assert data["skills"][0] == {"name": "Climb", "ranks": 4, "value": 7}
+    assert data["melee"][0][0]["critical"] == "19-20"
+    assert data["melee"][0][0]["damage"] == "1d8+3"
+    assert data["feats"] == ["Weapon Focus (Longsword)"]
+    assert data["equipment"] == [{"id": "armor/chain-mail", "active": True}]
+
+
+def test_json_output(monkeypatch):
+    character = statblock()
+    expected = StatblockTransformer(DataSink).toData(character)
+    assert json.loads(StatblockTransformer(JsonSink).dumps(character)) == expected
+    monkeypatch.setattr(traversal, "orjson", None)
+    assert json.loads(StatblockTransformer(JsonSink).dumps(character)) == expected
+
+
+def test_msgpack_output():
+    msgpack = pytest.importorskip("msgpack")
+    character = statblock()
+    output = io.BytesIO()
+    StatblockTransformer(MsgpackSink).write([character, character], output)
+    output.seek(0)
+    unpacked = list(msgpack.Unpacker(output, raw=False))
+    assert len(unpacked) == 2
+    assert unpacked[1] == StatblockTransformer(DataSink).toData(character)
+
+
+def test_json_lines():
+    output = io.BytesIO()
+    StatblockTransformer().write([statblock()] * 3, output)
+    lines = output.getvalue().splitlines()
+    assert [json.loads(line)["name"] for line in lines] == ["Cpl. Tomm Colworn"] * 3
+
+
+if __name__ == '__main__':
+    import sys
+    pytest.main(["-s", "-v"] + sys.argv[1:] + [__file__])
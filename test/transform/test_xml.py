@@ -1,13 +1,22 @@
+import io
+from types import SimpleNamespace
+
 import pytest
 from lxml import etree
 
 from statblock.armor import ChainMail
+from statblock.character import ActorBuilder
 from statblock.character import Character
 from statblock.character import MeleeAttackCombination
 from statblock.character import RangedAttackCombination
+from statblock.character import Size
 from statblock.feat import PowerAttack
 from statblock.feat import WeaponFocus
+from statblock.dice import d10
+from statblock.transform.xml import CachingXmlMarshaller
+from statblock.transform.xml import FastXmlMarshaller
 from statblock.transform.xml import StatblockTypeMap
+from statblock.transform.xml import XmlMarshaller
 from statblock.transform.xml import XmlTransformer
 from statblock.weapon import Longbow
 from statblock.weapon import Longsword
@@ -58,6 +67,248 @@ def test_typemap_is_treated_as_true_in_boolean_context():
     assert bool(StatblockTypeMap()) is True
 
 
+class AbilityMarshaller(XmlMarshaller):
+    "Marshals only what every character has."
+    
+    def marshal(self, character):
+        xml = self.element_maker
+        return xml.character(
+            xml.strength(character.strength), 
+            xml.size(character.size)
+        )
+
+
+def test_streaming_many_characters():
+    def characters(count):
+        for strength in range(count):
+            character = ActorBuilder(lazy_skills=True).build()
+            character.strength = strength
+            yield character
+    
+    transformer = XmlTransformer()
+    transformer.marshaller = AbilityMarshaller()
+    output = io.BytesIO()
+    transformer.write(characters(50), output, root="bestiary")
+    
+    document = etree.fromstring(output.getvalue())
+    assert document.tag == "bestiary"
+    assert document.xpath("count(/bestiary/character)") == 50
+    assert document.xpath("number(/bestiary/character[12]/strength)") == 11
+    assert document.xpath("string(//character[1]/size)") == "Medium"
+
+
+def statblock():
+    "What the marshallers expect of a character, built on a real one."
+    fighter = ActorBuilder(lazy_skills=True).build()
+    fighter.strength = 16
+    fighter.dexterity = 12
+    sword, bow = Longsword(), Longbow()
+    fighter.add_component(sword)
+    fighter.add_component(bow)
+    focus = WeaponFocus(sword)
+    fighter.add_component(focus)
+    fighter.add_equipment(ChainMail())
+    fighter.activate_equipment("armor/chain-mail")
+    fighter.configure("skill/climb", 4)
+    return SimpleNamespace(
+        name="Cpl. Tomm Colworn", gender="male", level=1, alignment="LG",
+        type_info=SimpleNamespace(name="Human", type="Humanoid", subtypes=["human"]),
+        size=fighter.size, initiative=fighter.initiative, speed=30,
+        skills=[fighter.registry.get("skill/climb"), fighter.registry.get("skill/hide")],
+        languages=["Common", "Draconic"], 
+        armor_class=fighter.armor_class, touch=fighter.touch, 
+        flat_footed=fighter.flat_footed, hit_points=fighter.hit_points, hit_dice=d10,
+        saving_throws=SimpleNamespace(
+            fortitude=fighter.fortitude, reflex=fighter.reflex, will=fighter.will),
+        attack=fighter.attack,
+        melee=[MeleeAttackCombination(sword)], ranged=[RangedAttackCombination(bow)],
+        abilities=fighter, feats=[focus],
+        equipment=fighter.equipment, slots=fighter.slots
+    )
+
+
+def test_fast_marshaller_writes_the_same_document():
+    character = statblock()
+    expected = etree.tostring(XmlTransformer().toElement(character))
+    fast = XmlTransformer(marshaller=FastXmlMarshaller())
+    assert etree.tostring(fast.toElement(character)) == expected
+    
+    document = fast.toElement(character)
+    assert document.xpath("string(//melee//weapon/critical)") == "19-20"
+    assert document.xpath("string(//skill[@name='Climb']/value)") == "7"
+    assert document.xpath("count(//equipment/item[@active='true'])") == 1
+
+
+
+def test_caching_marshaller_rebuilds_changed_sections():
+    character = statblock()
+    fast = XmlTransformer(marshaller=FastXmlMarshaller())
+    marshaller = CachingXmlMarshaller()
+    caching = XmlTransformer(marshaller=marshaller)
+    assert caching.toXml(character) == fast.toXml(character)
+    assert (marshaller.hits, marshaller.misses) == (0, 4)
+    
+    caching.toXml(character)
+    assert (marshaller.hits, marshaller.misses) == (4, 4)
+    
+    # strength shows in climb, the attacks and the abilities, not in defense
+    character.abilities.strength = 18
+    assert caching.toXml(character) == fast.toXml(character)
+    assert (marshaller.hits, marshaller.misses) == (5, 7)
+    
+    character.languages.append("Orc")
+    assert caching.toXml(character) == fast.toXml(character)
+    assert (marshaller.hits, marshaller.misses) == (8, 8)
+    
+    # hide is still the lazy view, setting ranks creates the real skill
+    character.skills[1].ranks = 2
+    assert caching.toXml(character) == fast.toXml(character)
+    assert (marshaller.hits, marshaller.misses) == (11, 9)
+
+
+def test_caching_marshaller_forgets_old_characters():
+    marshaller = CachingXmlMarshaller(size=1)
+    first, second = statblock(), statblock()
+    marshaller.serialize(first)
+    marshaller.serialize(second)
+    marshaller.serialize(first)
+    assert marshaller.misses == 12
+    
+    marshaller.forget(first)
+    marshaller.serialize(first)
+    assert marshaller.misses == 16
+
+
+def test_caching_marshaller_bytes_are_written_without_a_tree():
+    characters = [statblock() for _ in range(3)]
+    marshaller = CachingXmlMarshaller()
+    def no_tree(character):
+        raise AssertionError("the cached bytes should be used")
+    marshaller.marshal = no_tree
+    caching = XmlTransformer(marshaller=marshaller)
+    fast = XmlTransformer(marshaller=FastXmlMarshaller())
+    assert caching.toXml(characters[0]) == fast.toXml(characters[0])
+    
+    for encoding in ("utf-8", "ascii"):
+        expected, output = io.BytesIO(), io.BytesIO()
+        fast.write(characters, expected, encoding=encoding)
+        caching.write(characters, output, encoding=encoding)
+        assert output.getvalue() == expected.getvalue()
+        assert caching.export(characters, encoding=encoding) == \
+               fast.export(characters, encoding=encoding)
+
+
+
+def test_exporting_characters_in_order():
+    characters = [statblock() for _ in range(7)]
+    for strength, character in enumerate(characters, 10):
+        character.abilities.strength = strength
+    transformer = XmlTransformer(marshaller=CachingXmlMarshaller())
+    
+    documents = transformer.export(characters, workers=3, chunk_size=2)
+    assert documents == [transformer.toXml(c) for c in characters]
+    
+    expected = io.BytesIO()
+    transformer.write(characters, expected)
+    output = io.BytesIO()
+    assert transformer.export(iter(characters), output, workers=2, chunk_size=3) is None
+    assert output.getvalue() == expected.getvalue()
+
+
+def test_exporting_with_invalid_chunk_size():
+    with pytest.raises(ValueError):
+        XmlTransformer().export([statblock()], chunk_size=0)
+
+
+BESTIARY = b"""<?xml version='1.0' encoding='utf-8'?>
+<bestiary>
+  <character>
+    <name>Orc</name>
+    <size>Large</size>
+    <skills>
+      <skill name="Bluff" ranks="5"><value>5</value></skill>
+      <skill name="Hide"><value>4</value></skill>
+    </skills>
+    <melee><attack><weapon id="weapon/longsword" name="Longsword"/></attack></melee>
+    <abilities><strength>17</strength><dexterity>14</dexterity></abilities>
+    <feats>
+      <feat name="Improved Initiative"/>
+      <feat name="Weapon Focus (Longsword)"/>
+    </feats>
+    <equipment>
+      <item id="armor/chain-mail" active="true"/>
+      <item id="shield/heavy-steel-shield" active="false"/>
+    </equipment>
+  </character>
+  <character>
+    <name>Kobold</name>
+    <size>Small</size>
+    <abilities><dexterity>13</dexterity></abilities>
+  </character>
+</bestiary>
+"""
+
+
+def test_reading_characters():
+    characters = XmlTransformer().read(io.BytesIO(BESTIARY))
+    orc = next(characters)
+    assert orc.size.value == Size.LARGE
+    assert orc.strength.value == 17
+    assert orc.registry.get("skill/bluff").ranks == 5
+    assert orc.registry.get("skill/diplomacy").value == 2
+    assert orc.registry.get("skill/hide").ranks == 2
+    assert orc.initiative.value == 6
+    assert orc.registry.get("weapon/longsword/melee/attack").value == 3
+    assert orc.armor_class.value == 16
+    assert orc.equipment.has("shield/heavy-steel-shield")
+    
+    kobold = next(characters)
+    assert kobold.size.value == Size.SMALL
+    assert kobold.armor_class.value == 12
+    assert list(characters) == []
+
+
+def test_reading_skill_values_with_synergies():
+    bluff = b"<skill name='Bluff'><value>5</value></skill>"
+    diplomacy = b"<skill name='Diplomacy'><value>2</value></skill>"
+    for skills in (bluff + diplomacy, diplomacy + bluff):
+        character = XmlTransformer().fromXml(
+            b"<character><skills>" + skills + b"</skills></character>")
+        assert character.registry.get("skill/bluff").ranks == 5
+        assert character.registry.get("skill/diplomacy").ranks == 0
+        assert character.registry.get("skill/diplomacy").value == 2
+
+
+def test_reading_back_the_base_attack():
+    character = statblock()
+    fighter = character.abilities
+    fighter.attack.base.value = 3
+    fighter.size = Size.LARGE
+    transformer = XmlTransformer()
+    copy = transformer.fromXml(transformer.toXml(character))
+    assert copy.attack.base.initial == 3
+    assert copy.attack.base.value == fighter.attack.base.value == 2
+    for id in ("weapon/longsword/melee/attack", "weapon/longbow/ranged/attack"):
+        assert copy.registry.get(id).value == fighter.registry.get(id).value
+
+
+def test_reading_unknown_items():
+    document = b"<character><feats><feat name='Cleave'/></feats></character>"
+    with pytest.raises(ValueError):
+        XmlTransformer().fromXml(document)
+    with pytest.raises(ValueError):
+        XmlTransformer().fromXml(b"<character><size>Enormous</size></character>")
+
+
+def test_unmarshaller_is_only_created_for_reading():
+    transformer = XmlTransformer()
+    transformer.toXml(statblock())
+    assert transformer._unmarshaller is None
+    character = transformer.fromXml(b"<character><size>Small</size></character>")
+    assert character.size.value is Size.SMALL
+    assert transformer._unmarshaller is not None
+
+
 if __name__ == '__main__':
     import pytest, sys
     pytest.main(["-s", "-v"] + sys.argv[1:] + [__file__])